@@ -0,0 +1,308 @@
+"""Local HTTP service for Steiner analysis and ML-suggested measurements.
+
+One warm process serves every workstation in a clinic: requests arriving at the same
+time are collected into micro-batches, analysed in one vectorized pass, and run on a
+pool of worker processes that each load the ML model once.
+
+Usage:
+    python analysis_service.py --port 8750 --jobs 2 --ml
+    python main.py --serve --host 0.0.0.0 --ml
+
+Endpoints:
+    POST /analyse   {"landmarks": {...}} or {"cases": [{...}, ...]}, landmarks in the
+                    JSON landmark file format; answers {"results": [...]} in case order
+    GET  /health    service state
+    GET  /metrics   request, batch and latency counters
+"""
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import instrumentation
+from batch_analysis import analyse_points, init_worker, landmarks_from_mapping
+
+# Largest request body accepted, in bytes
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+
+class MicroBatcher:
+    """Collect concurrently submitted cases into batches and analyse them on a process pool
+
+    The first waiting case opens a batch, which is dispatched once it holds `max_batch`
+    cases or `max_delay` seconds have passed. At most `max_in_flight` batches run at once,
+    so a burst queues here instead of in the pool.
+    """
+
+    def __init__(self, pool, max_batch=256, max_delay=0.005, max_in_flight=4):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.batched_cases = 0
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, points):
+        """Queue an (N, 19, 2) array of cases; the future resolves to their N result rows"""
+        future = Future()
+        self._queue.put((points, future))
+        return future
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            size = len(item[0])
+            deadline = time.monotonic() + self.max_delay
+            stopping = False
+            while size < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            self._dispatch(batch)
+            if stopping:
+                return
+
+    def _dispatch(self, batch):
+        self._slots.acquire()
+        with self._stats_lock:
+            self.batches += 1
+            self.batched_cases += sum(len(points) for points, _ in batch)
+        try:
+            pool_future = self.pool.submit(analyse_points, np.concatenate([points for points, _ in batch]))
+        except Exception as e:
+            self._slots.release()
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        pool_future.add_done_callback(lambda done: self._complete(done, batch))
+
+    def _complete(self, pool_future, batch):
+        self._slots.release()
+        try:
+            rows = pool_future.result()
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        start = 0
+        for points, future in batch:
+            future.set_result(rows[start:start + len(points)])
+            start += len(points)
+
+
+class AnalysisService:
+    """Worker pool, micro-batcher and request metrics shared by all HTTP handler threads"""
+
+    def __init__(self, jobs=1, use_ml=False, max_batch=256, max_delay=0.005, timeout=30.0):
+        self.jobs = jobs
+        self.use_ml = use_ml
+        self.timeout = timeout
+        self.started = time.time()
+        self.pool = ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(use_ml,))
+        self.batcher = MicroBatcher(self.pool, max_batch, max_delay, max_in_flight=2 * jobs)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.cases = 0
+        self.failed_requests = 0
+        self.latencies = deque(maxlen=1000)
+
+    def warm_up(self):
+        """Start every worker and load its model before the first request arrives"""
+        empty = np.empty((0, 19, 2))
+        futures = [self.pool.submit(analyse_points, empty) for _ in range(self.jobs)]
+        for future in futures:
+            future.result()
+
+    def analyse(self, cases):
+        """Analyse a list of landmark mappings and return one result row per case"""
+        start = time.perf_counter()
+        results = [None] * len(cases)
+        points = []
+        readable = []
+        for i, case in enumerate(cases):
+            try:
+                points.append(landmarks_from_mapping(case).points)
+                readable.append(i)
+            except (AttributeError, ValueError, KeyError, IndexError, TypeError) as e:
+                results[i] = {'error': f"Could not read landmarks: {e}"}
+
+        if readable:
+            with instrumentation.span('service.analyse', cases=len(readable)):
+                rows = self.batcher.submit(np.stack(points)).result(timeout=self.timeout)
+            for i, row in zip(readable, rows):
+                results[i] = row
+
+        with self._lock:
+            self.requests += 1
+            self.cases += len(cases)
+            self.latencies.append(time.perf_counter() - start)
+        return results
+
+    def record_failure(self):
+        with self._lock:
+            self.failed_requests += 1
+
+    def health(self):
+        return {
+            'status': 'ok',
+            'workers': self.jobs,
+            'ml': self.use_ml,
+            'uptime_s': round(time.time() - self.started, 1),
+        }
+
+    def metrics(self):
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000
+            metrics = {
+                'requests': self.requests,
+                'failed_requests': self.failed_requests,
+                'cases': self.cases,
+            }
+        batches = self.batcher.batches
+        metrics.update({
+            'batches': batches,
+            'mean_batch_size': round(self.batcher.batched_cases / batches, 2) if batches else 0.0,
+            'queued_requests': self.batcher.pending(),
+            'latency_p50_ms': round(float(np.percentile(latencies, 50)), 3) if len(latencies) else None,
+            'latency_p95_ms': round(float(np.percentile(latencies, 95)), 3) if len(latencies) else None,
+        })
+        if instrumentation.is_enabled():
+            metrics['instrumentation'] = instrumentation.summary()
+        return metrics
+
+    def close(self):
+        self.batcher.close()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+class AnalysisRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'SteinerAnalysis/1'
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/health':
+            self._send_json(200, service.health())
+        elif self.path == '/metrics':
+            self._send_json(200, service.metrics())
+        else:
+            self._send_json(404, {'error': f"Unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        service = self.server.service
+        if self.path != '/analyse':
+            self._send_json(404, {'error': f"Unknown endpoint {self.path}"})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_SIZE:
+            service.record_failure()
+            self._send_json(413, {'error': "Request body too large"})
+            return
+        try:
+            data = json.loads(self.rfile.read(length))
+            cases = data['cases'] if 'cases' in data else [data['landmarks']]
+            if not isinstance(cases, list):
+                raise TypeError("'cases' must be a list")
+        except (ValueError, KeyError, TypeError) as e:
+            service.record_failure()
+            self._send_json(400, {'error': f"Invalid request: {e}"})
+            return
+
+        try:
+            results = service.analyse(cases)
+        except Exception as e:
+            service.record_failure()
+            self._send_json(500, {'error': f"Analysis failed: {e}"})
+            return
+        self._send_json(200, {'results': results})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class AnalysisHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for every workstation in a clinic to connect at once
+    request_queue_size = 128
+
+    def __init__(self, address, service, verbose=False):
+        super().__init__(address, AnalysisRequestHandler)
+        self.service = service
+        self.verbose = verbose
+
+
+def serve(host='127.0.0.1', port=8750, jobs=1, use_ml=False, max_batch=256, max_delay=0.005, verbose=False):
+    """Run the service until interrupted"""
+    service = AnalysisService(jobs, use_ml, max_batch, max_delay)
+    service.warm_up()
+    server = AnalysisHTTPServer((host, port), service, verbose)
+    print(f"Steiner analysis service listening on http://{host}:{server.server_address[1]}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local Steiner's cephalometric analysis service")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="Address to listen on (0.0.0.0 to serve other workstations)")
+    parser.add_argument('--port', type=int, default=8750, help="Port to listen on")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="Worker processes")
+    parser.add_argument('--ml', action='store_true', help="Include ML-suggested measurements")
+    parser.add_argument('--max-batch', type=int, default=256, help="Most cases analysed per batch")
+    parser.add_argument('--max-delay-ms', type=float, default=5.0,
+                        help="Longest wait for more requests to join a batch")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Log every request")
+    args = parser.parse_args(argv)
+    return serve(args.host, args.port, args.jobs, args.ml, args.max_batch, args.max_delay_ms / 1000,
+                 args.verbose)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""Headless batch Steiner analysis over a directory or manifest of landmark files.
+
+Usage:
+    python batch_analysis.py tracings/ -o results.csv --jobs 8 --ml
+    python main.py --batch manifest.txt -o results.jsonl
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from image_module import find_images
+from landmark_set import LandmarkSet, landmark_features
+from steiner_module import (LANDMARK_INDEX, LANDMARK_NAMES, MEASUREMENT_NAMES, REQUIRED_LANDMARKS,
+                            calculate_measurements, interpret_measurements, missing_required_landmarks)
+
+LANDMARK_FILE_EXTENSIONS = ('.csv', '.json')
+
+INTERPRETATION_FIELDS = ('skeletal_pattern', 'upper_incisor', 'lower_incisor')
+
+# Per-process ML module, created once by the pool initializer
+_worker_ml = None
+
+
+def find_landmark_files(source):
+    """Return the landmark files in a directory, or the paths listed in a manifest file"""
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, name) for name in os.listdir(source)
+            if name.lower().endswith(LANDMARK_FILE_EXTENSIONS)
+        )
+
+    # Manifest: one path per line, relative paths are resolved against the manifest
+    base = os.path.dirname(os.path.abspath(source))
+    paths = []
+    with open(source, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                paths.append(line if os.path.isabs(line) else os.path.join(base, line))
+    return paths
+
+
+def pair_tracings(images_dir, tracings_dir):
+    """Match each image to the landmark file with the same name
+
+    Returns (image path, points) pairs and {tracing path: error} for tracings that could not be read.
+    """
+    cases = []
+    errors = {}
+    for image_path in find_images(images_dir):
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        for extension in LANDMARK_FILE_EXTENSIONS:
+            tracing_path = os.path.join(tracings_dir, stem + extension)
+            if os.path.exists(tracing_path):
+                try:
+                    cases.append((image_path, load_landmark_file(tracing_path).points))
+                except Exception as e:
+                    errors[tracing_path] = str(e)
+                break
+    return cases, errors
+
+
+def _coordinate(value):
+    if value is None or value == '':
+        return None
+    return float(value)
+
+
+def landmarks_from_mapping(data):
+    """Build a LandmarkSet from a JSON-style mapping of names to {"x", "y"} or [x, y]"""
+    # Accept either {"landmarks": {...}} or the landmarks mapping itself
+    data = data.get('landmarks', data)
+    entries = []
+    for name, pos in data.items():
+        if isinstance(pos, dict):
+            entries.append((name, pos.get('x'), pos.get('y')))
+        else:
+            entries.append((name, pos[0], pos[1]))
+    return _landmarks_from_entries(entries)
+
+
+def load_landmark_file(path):
+    """Read a CSV or JSON landmark file into a LandmarkSet"""
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            return landmarks_from_mapping(json.load(f))
+
+    # CSV: one landmark per row with "landmark", "x" and "y" columns
+    with open(path, newline='', encoding='utf-8') as f:
+        entries = [(row['landmark'], row['x'], row['y']) for row in csv.DictReader(f)]
+    return _landmarks_from_entries(entries)
+
+
+def _landmarks_from_entries(entries):
+    canonical = {name.lower(): LANDMARK_INDEX[name] for name in LANDMARK_NAMES}
+    landmarks = LandmarkSet()
+    for name, x, y in entries:
+        index = canonical.get(str(name).strip().lower())
+        if index is None:
+            raise ValueError(f"Unknown landmark '{name}'")
+        x, y = _coordinate(x), _coordinate(y)
+        if x is not None and y is not None:
+            landmarks.points[index] = (x, y)
+    return landmarks
+
+
+def init_worker(use_ml):
+    """Process pool initializer: load the ML model once per worker process"""
+    global _worker_ml
+    if use_ml:
+        from ml_module import CephalometricML
+        _worker_ml = CephalometricML()
+
+
+def analyse_points(points):
+    """Analyse an (N, 19, 2) batch of landmark arrays and return one result row per case"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, len(LANDMARK_NAMES), 2)
+    rows = [{'error': ''} for _ in range(len(points))]
+
+    # One vectorized pass over the whole batch
+    measurements = calculate_measurements(points)
+    interpretation = interpret_measurements(measurements)
+    missing = missing_required_landmarks(points)
+
+    # One batched ML prediction for every complete case; missing coordinates are 0 as in the GUI
+    ml_predictions = None
+    complete = np.flatnonzero(~missing.any(axis=1))
+    if _worker_ml is not None and len(complete):
+        ml_predictions = _worker_ml.predict_measurements_batch(landmark_features(points[complete]))
+        if ml_predictions is not None:
+            ml_predictions = dict(zip(complete.tolist(), ml_predictions))
+
+    for i, row in enumerate(rows):
+        if missing[i].any():
+            names = [name for name, absent in zip(REQUIRED_LANDMARKS, missing[i]) if absent]
+            row['error'] = f"Missing required landmarks: {', '.join(names)}"
+            continue
+
+        for measure in MEASUREMENT_NAMES:
+            row[measure] = round(float(measurements[measure][i]), 3)
+        for field in INTERPRETATION_FIELDS:
+            row[field] = str(interpretation[field][i])
+
+        if ml_predictions is not None:
+            for j, measure in enumerate(MEASUREMENT_NAMES):
+                row[f"ML_{measure}"] = round(float(ml_predictions[i][j]), 3)
+    return rows
+
+
+def analyse_chunk(paths):
+    """Analyse a chunk of landmark files and return one result row per file"""
+    rows = [{'file': path, 'error': ''} for path in paths]
+    points = np.full((len(paths), len(LANDMARK_NAMES), 2), np.nan, dtype=np.float32)
+    for i, path in enumerate(paths):
+        try:
+            points[i] = load_landmark_file(path).points
+        except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+            rows[i]['error'] = f"Could not read landmarks: {e}"
+
+    readable = [i for i, row in enumerate(rows) if not row['error']]
+    for i, result in zip(readable, analyse_points(points[readable])):
+        rows[i].update(result)
+    return rows
+
+
+class ResultWriter:
+    """Stream result rows to CSV, JSON lines or Parquet as chunks complete"""
+
+    def __init__(self, path, use_ml):
+        self.path = path
+        self.fields = ['file', *MEASUREMENT_NAMES, *INTERPRETATION_FIELDS]
+        self.numeric_fields = set(MEASUREMENT_NAMES)
+        if use_ml:
+            ml_fields = [f"ML_{measure}" for measure in MEASUREMENT_NAMES]
+            self.fields += ml_fields
+            self.numeric_fields.update(ml_fields)
+        self.fields.append('error')
+
+        self.format = os.path.splitext(path)[1].lower()
+        self.parquet_writer = None
+        if self.format == '.parquet':
+            try:
+                import pyarrow as pa
+            except ImportError:
+                raise SystemExit("Parquet output requires pyarrow; use a .csv or .jsonl output instead")
+            # Fixed up front: a chunk of only failed files would otherwise infer null-typed columns
+            self.schema = pa.schema([(field, pa.float64() if field in self.numeric_fields else pa.string())
+                                     for field in self.fields])
+            self.file = None
+        elif self.format in ('.jsonl', '.json'):
+            self.file = open(path, 'w', encoding='utf-8')
+        else:
+            self.file = open(path, 'w', newline='', encoding='utf-8')
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=self.fields, restval='')
+            self.csv_writer.writeheader()
+
+    def write(self, rows):
+        if self.format == '.parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pylist([{field: row.get(field) for field in self.fields} for row in rows],
+                                         schema=self.schema)
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.path, self.schema)
+            self.parquet_writer.write_table(table)
+        elif self.format in ('.jsonl', '.json'):
+            for row in rows:
+                self.file.write(json.dumps(row) + '\n')
+        else:
+            self.csv_writer.writerows(rows)
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+        if self.file is not None:
+            self.file.close()
+
+
+def run_batch(paths, output, jobs=None, chunk_size=256, use_ml=False):
+    """Analyse landmark files on a process pool, writing each chunk as soon as it finishes"""
+    jobs = jobs or os.cpu_count() or 1
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    writer = ResultWriter(output, use_ml)
+    done_files = 0
+    failed_files = 0
+    try:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(use_ml,)) as pool:
+            pending = set()
+            next_chunk = 0
+            while next_chunk < len(chunks) or pending:
+                # Keep a bounded number of chunks in flight so memory stays flat
+                while next_chunk < len(chunks) and len(pending) < 2 * jobs:
+                    pending.add(pool.submit(analyse_chunk, chunks[next_chunk]))
+                    next_chunk += 1
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    rows = future.result()
+                    writer.write(rows)
+                    done_files += len(rows)
+                    failed_files += sum(1 for row in rows if row['error'])
+                    print(f"{done_files}/{len(paths)} files analysed", file=sys.stderr)
+    finally:
+        writer.close()
+    return done_files, failed_files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch Steiner's cephalometric analysis")
+    parser.add_argument('source', help="Directory of landmark files (CSV/JSON) or a manifest listing them")
+    parser.add_argument('-o', '--output', default='steiner_results.csv',
+                        help="Output file (.csv, .jsonl or .parquet)")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--chunk-size', type=int, default=256, help="Files analysed per worker task")
+    parser.add_argument('--ml', action='store_true', help="Include ML-suggested measurements")
+    args = parser.parse_args(argv)
+
+    paths = find_landmark_files(args.source)
+    if not paths:
+        print(f"No landmark files found in {args.source}", file=sys.stderr)
+        return 1
+
+    done, failed = run_batch(paths, args.output, args.jobs, args.chunk_size, args.ml)
+    print(f"Analysed {done} files ({failed} with errors) -> {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,348 @@
+"""Reproducible benchmarks for the measurement, ML and image hot paths.
+
+Usage:
+    python benchmark.py -o bench.json
+    python benchmark.py --quick -o new.json --compare bench.json --threshold 0.25 --memory-threshold 0.25
+
+Inputs are synthetic landmark sets and cephalogram-sized images from a fixed seed.
+Each benchmark reports latency percentiles, throughput and peak memory; with --compare
+the run exits non-zero if any median latency or peak memory regressed past its threshold.
+Latencies timed fewer than MIN_COMPARE_REPEAT times are reported but never flagged.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+from PIL import Image
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from image_module import ImagePyramid, Viewport
+from landmark_set import LandmarkSet, stack_landmark_sets
+from measurement_graph import STEINER_MEASUREMENTS, build_steiner_graph
+from steiner_module import LANDMARK_NAMES, MEASUREMENT_NAMES, angle_between_lines, calculate_measurements
+
+SEED = 1234
+MIN_COMPARE_REPEAT = 3
+# Peak memory changes smaller than this are allocator noise and never flagged
+MIN_MEMORY_CHANGE_KB = 256
+
+
+def synthetic_landmarks(n, rng):
+    """(n, 19, 2) landmark sets scattered around a plausible mean tracing on a 3000x2400 image"""
+    mean = rng.uniform((600, 400), (2400, 2000), size=(len(LANDMARK_NAMES), 2))
+    return mean + rng.normal(0, 40, size=(n, len(LANDMARK_NAMES), 2))
+
+
+def to_landmark_dict(points):
+    return {name: {'x': float(x), 'y': float(y)} for name, (x, y) in zip(LANDMARK_NAMES, points)}
+
+
+def synthetic_cephalogram(rng, size=(3000, 2400)):
+    """Grayscale image with smooth anatomy-like gradients and film grain"""
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    image = 90 + 60 * np.sin(x / 180) * np.cos(y / 240) + rng.normal(0, 12, size=(height, width))
+    return Image.fromarray(np.clip(image, 0, 255).astype(np.uint8))
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where it cannot be read"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def release_free_memory():
+    """Hand freed heap pages back to the OS (glibc only) so reused blocks do not hide allocations"""
+    libc_name = ctypes.util.find_library('c')
+    try:
+        ctypes.CDLL(libc_name).malloc_trim(0)
+    except (OSError, AttributeError, TypeError):
+        pass
+
+
+def peak_rss_increase(function, interval=0.001):
+    """Call `function` while sampling RSS and return the peak increase in bytes (None if unavailable)
+
+    Unlike tracemalloc this sees allocations made in C, such as Pillow's image buffers.
+    """
+    release_free_memory()
+    baseline = current_rss()
+    if baseline is None:
+        function()
+        return None
+    peak = baseline
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.is_set():
+            peak = max(peak, current_rss())
+            done.wait(interval)
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        function()
+    finally:
+        done.set()
+        sampler.join()
+    return max(peak, current_rss()) - baseline
+
+
+def measure(function, repeat, items=1, warmup=1, setup=None, memory='traced'):
+    """Time `function` and return latency percentiles, throughput and peak memory
+
+    Memory is measured in an extra call so its overhead does not skew the timings, either
+    with tracemalloc ('traced', Python allocations) or by sampling the process RSS ('rss',
+    for work done in C). `setup` runs untimed before every call, for benchmarks that change
+    state when run (such as incremental retraining).
+    """
+    def call():
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        return time.perf_counter() - start
+
+    for _ in range(warmup):
+        call()
+    latencies = np.array([call() for _ in range(repeat)])
+
+    if setup is not None:
+        setup()
+    if memory == 'rss':
+        peak = peak_rss_increase(function)
+    else:
+        tracemalloc.start()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'repeat': repeat,
+        'items': items,
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p95_ms': float(np.percentile(latencies, 95) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'throughput_per_s': float(items / latencies.mean()),
+        'memory': memory,
+        'peak_memory_kb': None if peak is None else peak / 1024,
+    }
+
+
+def bench_measurements(rng, quick):
+    results = {}
+    v1, v2 = rng.normal(size=2), rng.normal(size=2)
+    results['angle_between_lines/single'] = measure(lambda: angle_between_lines(v1, v2), 2000)
+
+    batch = 10000 if quick else 100000
+    lines = rng.normal(size=(2, batch, 2))
+    results[f'angle_between_lines/batch_{batch}'] = measure(
+        lambda: angle_between_lines(lines[0], lines[1]), 20, items=batch)
+
+    points = synthetic_landmarks(batch, rng)
+    single = points[:1]
+    results['steiner_calculators/single'] = measure(lambda: calculate_measurements(single), 2000)
+    results[f'steiner_calculators/batch_{batch}'] = measure(
+        lambda: calculate_measurements(points), 20, items=batch)
+
+    landmarks = to_landmark_dict(points[0])
+    results['steiner_calculators/from_gui_dict'] = measure(
+        lambda: calculate_measurements(LandmarkSet.from_dict(landmarks).points[np.newaxis]), 2000)
+    results['landmark_set/from_gui_dict'] = measure(lambda: LandmarkSet.from_dict(landmarks), 2000)
+    landmark_sets = [LandmarkSet(p) for p in points[:1000]]
+    results['landmark_set/stack_1000'] = measure(lambda: stack_landmark_sets(landmark_sets), 200, items=1000)
+
+    # Live re-analysis: one landmark moves, every measurement is read back
+    graph = build_steiner_graph()
+    graph.set_landmarks(landmarks)
+    moves = iter(rng.uniform(0, 3000, size=(100000, 2)))
+
+    def drag_update():
+        graph.set_landmark('Supramentale (B Point)', next(moves))
+        graph.evaluate(STEINER_MEASUREMENTS)
+    results['measurement_graph/single_edit'] = measure(drag_update, 2000)
+    return results
+
+
+def bench_ml(rng, quick):
+    warnings.filterwarnings('ignore')
+    from ml_module import CephalometricML
+
+    results = {}
+    corpus_sizes = (250, 1000) if quick else (250, 1000, 4000)
+    workdir = tempfile.mkdtemp(prefix='ceph_bench_')
+    cwd = os.getcwd()
+    try:
+        # Model files are written relative to the working directory
+        os.chdir(workdir)
+        retrain_repeat = MIN_COMPARE_REPEAT if quick else 5
+        for size in corpus_sizes:
+            ml = CephalometricML(store_dir=f'store_{size}')
+            points = synthetic_landmarks(size, rng)
+            measurements = calculate_measurements(points)
+            labels = np.stack([measurements[name] for name in MEASUREMENT_NAMES], axis=1)
+            ml.store.append(points.reshape(size, -1), labels)
+
+            results[f'retrain_model/full_{size}'] = measure(
+                lambda: ml.retrain_model(incremental=False), retrain_repeat, items=size, warmup=0)
+            # Each incremental run trains on 20 rows that arrived since the previous one
+            results[f'retrain_model/incremental_20_on_{size}'] = measure(
+                lambda: ml.retrain_model(incremental=True), retrain_repeat, items=20, warmup=0,
+                setup=lambda: ml.store.append(synthetic_landmarks(20, rng).reshape(20, -1), labels[:20]))
+
+        landmarks = to_landmark_dict(synthetic_landmarks(1, rng)[0])
+        results['prepare_input_features'] = measure(lambda: ml.prepare_input_features(landmarks), 2000)
+        results['predict_measurements/numpy'] = measure(
+            lambda: (ml.clear_prediction_cache(), ml.predict_measurements(landmarks)), 500)
+        results['predict_measurements/cached'] = measure(lambda: ml.predict_measurements(landmarks), 2000)
+        results['predict_measurements/sklearn'] = measure(
+            lambda: ml.predict_measurements(landmarks, use_sklearn=True), 200)
+
+        batch = 1000 if quick else 10000
+        features = synthetic_landmarks(batch, rng).reshape(batch, -1)
+        results[f'predict_measurements_batch/{batch}'] = measure(
+            lambda: (ml.clear_prediction_cache(), ml.predict_measurements_batch(features)), 10, items=batch)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def bench_images(rng, quick):
+    results = {}
+    image = synthetic_cephalogram(rng)
+    canvas = (900, 760)
+
+    # The resize done by display_image before the pyramid existed, kept as a reference point
+    ratio = min(canvas[0] / image.size[0], canvas[1] / image.size[1])
+    fit_size = (int(image.size[0] * ratio), int(image.size[1] * ratio))
+    results['display_image/full_lanczos_resize'] = measure(
+        lambda: image.resize(fit_size, Image.LANCZOS), 5 if quick else 20, memory='rss')
+
+    results['display_image/build_pyramid'] = measure(
+        lambda: ImagePyramid(image), 5 if quick else 20, memory='rss')
+    pyramid = ImagePyramid(image)
+    for zoom in (1, 4, 16):
+        viewport = Viewport(pyramid.size, canvas)
+        viewport.zoom(zoom, canvas[0] / 2, canvas[1] / 2)
+        _, box = viewport.visible_region()
+        results[f'display_image/render_zoom_{zoom}x'] = measure(
+            lambda: pyramid.render(viewport.scale, box), 20 if quick else 100, memory='rss')
+    return results
+
+
+def _memory_change(result, previous):
+    """Relative and absolute (KB) change in peak memory, or None if the two are not comparable"""
+    before, after = previous.get('peak_memory_kb'), result.get('peak_memory_kb')
+    if before is None or after is None or previous.get('memory', 'traced') != result['memory']:
+        return None
+    return (after / before - 1 if before else 0.0), after - before
+
+
+def compare(results, baseline, threshold, memory_threshold):
+    """Print the change in median latency and peak memory against a baseline and return the regressed benchmarks
+
+    A median of fewer than MIN_COMPARE_REPEAT runs is too noisy to flag, so such latencies
+    are printed for reference only. Peak memory is flagged when it grows by more than
+    `memory_threshold` and by at least MIN_MEMORY_CHANGE_KB.
+    """
+    regressions = []
+    print(f"{'benchmark':55s} {'baseline':>10s} {'current':>10s} {'change':>8s} "
+          f"{'base KB':>10s} {'cur KB':>10s} {'change':>8s}")
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:55s} {'-':>10s} {result['p50_ms']:10.3f}      new")
+            continue
+        change = result['p50_ms'] / previous['p50_ms'] - 1 if previous['p50_ms'] else 0.0
+        flags = []
+        if min(result['repeat'], previous['repeat']) < MIN_COMPARE_REPEAT:
+            flags.append('(too few runs to compare latency)')
+        elif change > threshold:
+            flags.append('LATENCY REGRESSION')
+
+        memory = _memory_change(result, previous)
+        if memory is None:
+            memory_columns = f"{'-':>10s} {'-':>10s} {'-':>8s}"
+        else:
+            memory_change, memory_increase_kb = memory
+            memory_columns = (f"{previous['peak_memory_kb']:10.1f} {result['peak_memory_kb']:10.1f} "
+                              f"{memory_change:+8.1%}")
+            if memory_change > memory_threshold and memory_increase_kb >= MIN_MEMORY_CHANGE_KB:
+                flags.append('MEMORY REGRESSION')
+
+        if any(flag.endswith('REGRESSION') for flag in flags):
+            regressions.append(name)
+        flag = ''.join('  ' + flag for flag in flags)
+        print(f"{name:55s} {previous['p50_ms']:10.3f} {result['p50_ms']:10.3f} {change:+8.1%} {memory_columns}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the measurement, ML and image hot paths")
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help="Results JSON file")
+    parser.add_argument('--quick', action='store_true', help="Smaller batches and corpora")
+    parser.add_argument('--only', choices=('measurements', 'ml', 'images'), action='append',
+                        help="Run only these groups (repeatable)")
+    parser.add_argument('--compare', help="Baseline results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="Allowed relative increase in median latency (default 0.25)")
+    parser.add_argument('--memory-threshold', type=float, default=0.25,
+                        help="Allowed relative increase in peak memory (default 0.25)")
+    args = parser.parse_args(argv)
+
+    groups = {'measurements': bench_measurements, 'ml': bench_ml, 'images': bench_images}
+    results = {}
+    for group in args.only or groups:
+        print(f"Running {group} benchmarks...", file=sys.stderr)
+        results.update(groups[group](np.random.default_rng(SEED), args.quick))
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'quick': args.quick,
+            'seed': SEED,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold, args.memory_threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%} in latency "
+                  f"or {args.memory_threshold:.0%} in peak memory", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""CPU-only automatic landmark detection by coarse-to-fine template matching.
+
+Each landmark is learned from existing tracings as a mean image patch at several
+resolutions plus a prior over its position in the image. Detection searches the
+prior region at the coarsest resolution with FFT-based normalized cross-correlation,
+then refines the match in a small window at each finer resolution.
+
+Usage:
+    python detection_module.py train images/ tracings/
+    python detection_module.py detect images/ -o detections.json
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+from image_module import HIGH_BIT_DEPTH_MODES, find_images, open_cephalogram, to_8bit
+from steiner_module import LANDMARK_NAMES
+
+# Bump when the layout of the saved detector changes
+DETECTOR_FORMAT_VERSION = 1
+
+
+def _normalize_patch(patch):
+    """Zero-mean, unit-norm copy of a patch (all zeros for a flat patch)"""
+    patch = patch - patch.mean()
+    norm = np.sqrt((patch ** 2).sum())
+    return patch / norm if norm > 1e-6 else np.zeros_like(patch)
+
+
+def _window_sums(image, size):
+    """Sum over every size x size window of `image`, for the valid positions only"""
+    integral = np.pad(image.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    return (integral[size:, size:] - integral[:-size, size:]
+            - integral[size:, :-size] + integral[:-size, :-size])
+
+
+def match_template(window, template):
+    """Normalized cross-correlation of a zero-mean unit-norm template over `window` via FFT"""
+    size = template.shape[0]
+    shape = window.shape
+    correlation = np.fft.irfft2(np.fft.rfft2(window) * np.conj(np.fft.rfft2(template, shape)), shape)
+    correlation = correlation[:shape[0] - size + 1, :shape[1] - size + 1]
+
+    # Local standard deviation of every window position
+    n = size * size
+    sums = _window_sums(window, size)
+    squares = _window_sums(window * window, size)
+    energy = np.sqrt(np.maximum(squares - sums * sums / n, 1e-6))
+    return correlation / energy
+
+
+class LandmarkDetector:
+    """Template-matching landmark detector trained incrementally from tracings"""
+
+    def __init__(self, level_sizes=(128, 256, 512, 1024), patch_size=33, refine_radius=6,
+                 model_path='landmark_detector.npz'):
+        self.level_sizes = tuple(level_sizes)
+        self.patch_size = patch_size
+        self.refine_radius = refine_radius
+        self.model_path = model_path
+
+        n_landmarks = len(LANDMARK_NAMES)
+        # Running sums so tracings can be added one at a time without keeping images
+        self.patch_sums = np.zeros((len(self.level_sizes), n_landmarks, patch_size, patch_size))
+        self.position_sums = np.zeros((n_landmarks, 2))
+        self.position_squares = np.zeros((n_landmarks, 2))
+        self.counts = np.zeros(n_landmarks, dtype=np.int64)
+
+    def is_trained(self):
+        return bool((self.counts > 0).all())
+
+    def _levels(self, image):
+        """Grayscale float32 copies of the image with the longest side at each level size"""
+        if image.mode in HIGH_BIT_DEPTH_MODES:
+            image = to_8bit(image)
+        elif image.mode != 'L':
+            image = image.convert('L')
+        width, height = image.size
+        levels = []
+        for size in self.level_sizes:
+            scale = size / max(width, height)
+            resized = image.resize((max(1, round(width * scale)), max(1, round(height * scale))),
+                                   Image.BILINEAR, reducing_gap=2.0)
+            levels.append((np.asarray(resized, dtype=np.float32) / 255.0, scale))
+        return levels
+
+    def _patch(self, level_image, x, y):
+        """Extract a patch centred on (x, y), padding with edge pixels near the border"""
+        half = self.patch_size // 2
+        padded = np.pad(level_image, half + 1, mode='edge')
+        cx = int(round(x)) + half + 1
+        cy = int(round(y)) + half + 1
+        cx = min(max(cx, half), padded.shape[1] - half - 1)
+        cy = min(max(cy, half), padded.shape[0] - half - 1)
+        return padded[cy - half:cy + half + 1, cx - half:cx + half + 1]
+
+    def add_tracing(self, image, points):
+        """Add one traced image; `points` is a (19, 2) array with NaN for missing landmarks"""
+        points = np.asarray(points, dtype=np.float64)
+        width, height = image.size
+        levels = self._levels(image)
+        for i, (x, y) in enumerate(points):
+            if np.isnan(x) or np.isnan(y):
+                continue
+            for level, (level_image, scale) in enumerate(levels):
+                self.patch_sums[level, i] += _normalize_patch(self._patch(level_image, x * scale, y * scale))
+            relative = np.array([x / width, y / height])
+            self.position_sums[i] += relative
+            self.position_squares[i] += relative ** 2
+            self.counts[i] += 1
+
+    def fit(self, images, point_sets):
+        """Train from scratch on a batch of images and their (19, 2) landmark arrays"""
+        self.__init__(self.level_sizes, self.patch_size, self.refine_radius, self.model_path)
+        for image, points in zip(images, point_sets):
+            self.add_tracing(image, points)
+        return self
+
+    def _prior(self):
+        """Mean and standard deviation of each landmark position as a fraction of image size"""
+        counts = np.maximum(self.counts, 1)[:, None]
+        mean = self.position_sums / counts
+        std = np.sqrt(np.maximum(self.position_squares / counts - mean ** 2, 0))
+        return mean, std
+
+    def detect(self, image):
+        """Detect all landmarks in one image, returning (19, 2) points and (19,) confidences"""
+        if not self.is_trained():
+            raise RuntimeError("The landmark detector has not been trained yet")
+
+        width, height = image.size
+        levels = self._levels(image)
+        mean, std = self._prior()
+        templates = [[_normalize_patch(patch) for patch in level] for level in self.patch_sums]
+        half = self.patch_size // 2
+
+        points = np.empty((len(LANDMARK_NAMES), 2))
+        confidence = np.empty(len(LANDMARK_NAMES))
+        for i in range(len(LANDMARK_NAMES)):
+            # Coarsest level: search the whole prior region (three standard deviations)
+            level_image, scale = levels[0]
+            x = mean[i, 0] * width * scale
+            y = mean[i, 1] * height * scale
+            rx = max(3 * std[i, 0] * width * scale, 4)
+            ry = max(3 * std[i, 1] * height * scale, 4)
+
+            for level, (level_image, scale) in enumerate(levels):
+                if level > 0:
+                    # Carry the match up one level and refine in a small window
+                    factor = scale / levels[level - 1][1]
+                    x, y = x * factor, y * factor
+                    rx = ry = self.refine_radius
+
+                pad = half + int(np.ceil(max(rx, ry))) + 1
+                padded = np.pad(level_image, pad, mode='edge')
+                left = int(round(x - rx)) - half + pad
+                top = int(round(y - ry)) - half + pad
+                right = int(round(x + rx)) + half + 1 + pad
+                bottom = int(round(y + ry)) + half + 1 + pad
+                scores = match_template(padded[top:bottom, left:right], templates[level][i])
+
+                best_y, best_x = np.unravel_index(np.argmax(scores), scores.shape)
+                x = left - pad + best_x + half
+                y = top - pad + best_y + half
+                score = scores[best_y, best_x]
+
+            points[i] = (x / scale, y / scale)
+            confidence[i] = float(np.clip(score, 0.0, 1.0))
+
+        # Keep detections inside the image
+        points[:, 0] = np.clip(points[:, 0], 0, width - 1)
+        points[:, 1] = np.clip(points[:, 1], 0, height - 1)
+        return points, confidence
+
+    def detect_batch(self, images):
+        """Detect landmarks in a batch of images, returning (N, 19, 2) points and (N, 19) confidences"""
+        results = [self.detect(image) for image in images]
+        if not results:
+            return np.empty((0, len(LANDMARK_NAMES), 2)), np.empty((0, len(LANDMARK_NAMES)))
+        return np.stack([r[0] for r in results]), np.stack([r[1] for r in results])
+
+    def save(self, path=None):
+        np.savez(path or self.model_path,
+                 format_version=np.array(DETECTOR_FORMAT_VERSION),
+                 level_sizes=np.array(self.level_sizes),
+                 patch_size=np.array(self.patch_size),
+                 refine_radius=np.array(self.refine_radius),
+                 patch_sums=self.patch_sums,
+                 position_sums=self.position_sums,
+                 position_squares=self.position_squares,
+                 counts=self.counts)
+
+    @classmethod
+    def load(cls, path='landmark_detector.npz'):
+        with np.load(path) as data:
+            version = int(data['format_version'])
+            if version != DETECTOR_FORMAT_VERSION:
+                raise ValueError(f"Unsupported detector format version {version}")
+            detector = cls(tuple(int(s) for s in data['level_sizes']), int(data['patch_size']),
+                           int(data['refine_radius']), path)
+            detector.patch_sums = data['patch_sums']
+            detector.position_sums = data['position_sums']
+            detector.position_squares = data['position_squares']
+            detector.counts = data['counts']
+        return detector
+
+    @classmethod
+    def load_or_create(cls, path='landmark_detector.npz'):
+        return cls.load(path) if os.path.exists(path) else cls(model_path=path)
+
+
+def main(argv=None):
+    from batch_analysis import pair_tracings
+
+    parser = argparse.ArgumentParser(description="Train or run the automatic landmark detector")
+    parser.add_argument('--model', default='landmark_detector.npz', help="Detector file")
+    commands = parser.add_subparsers(dest='command', required=True)
+    train = commands.add_parser('train', help="Add traced images to the detector")
+    train.add_argument('images', help="Directory of cephalograms")
+    train.add_argument('tracings', help="Directory of CSV/JSON landmark files named like the images")
+    detect = commands.add_parser('detect', help="Detect landmarks in a directory of images")
+    detect.add_argument('images', help="Directory of cephalograms")
+    detect.add_argument('-o', '--output', default='detections.json', help="Output JSON file")
+    args = parser.parse_args(argv)
+
+    detector = LandmarkDetector.load_or_create(args.model)
+    if args.command == 'train':
+        cases, tracing_errors = pair_tracings(args.images, args.tracings)
+        for path, error in tracing_errors.items():
+            print(f"{path}: {error}", file=sys.stderr)
+        for image_path, points in cases:
+            # Same upright 8-bit pixels and coordinates as the GUI
+            image, _ = open_cephalogram(image_path)
+            detector.add_tracing(image, points)
+        detector.save()
+        print(f"Added {len(cases)} tracings to {args.model}", file=sys.stderr)
+        return 1 if tracing_errors else 0
+
+    results = {}
+    for image_path in find_images(args.images):
+        image, _ = open_cephalogram(image_path)
+        points, confidence = detector.detect(image)
+        results[image_path] = {
+            name: {'x': round(float(x), 2), 'y': round(float(y), 2), 'confidence': round(float(c), 3)}
+            for name, (x, y), c in zip(LANDMARK_NAMES, points, confidence)
+        }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Detected landmarks in {len(results)} images -> {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
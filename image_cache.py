@@ -0,0 +1,236 @@
+"""Content-addressed on-disk cache of decoded, normalized cephalograms.
+
+Each source file is identified by the SHA-256 of its content. Its cache entry holds the
+upright 8-bit grayscale image and every display pyramid level as .npy files, which are
+memory-mapped when the case is opened again, so a cached case is never decoded or
+resampled twice. Zooming in on a cached case only pages in the full-resolution rows it
+shows, and those pages are shared and can be dropped by the OS under memory pressure.
+Entries are evicted least recently used first once the cache exceeds its size limit.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+import instrumentation
+from image_module import ImagePyramid, open_cephalogram
+
+# Bump when the layout or normalization of cache entries changes
+CACHE_FORMAT_VERSION = 1
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's content, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ImageCache:
+    """Directory of normalized cephalograms and their pyramids, bounded to `max_bytes` on disk"""
+
+    def __init__(self, directory='image_cache', max_bytes=2 * 1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, 'index.json')
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # Source path, size and modification time -> content digest, so unchanged files are not rehashed
+        self._index = {}
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, encoding='utf-8') as f:
+                    self._index = json.load(f)
+            except ValueError:
+                self._index = {}
+
+    def _entry_dir(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def digest(self, path):
+        """Content digest of `path`, hashing the file only when it changed since it was last seen"""
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+        with self._lock:
+            digest = self._index.get(key)
+        if digest is None:
+            digest = file_digest(path)
+            with self._lock:
+                self._index[key] = digest
+                self._save_index()
+        return digest
+
+    def _save_index(self):
+        # A temporary file of its own, so processes sharing the cache never write into the same one
+        fd, temporary = tempfile.mkstemp(prefix='index.', suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._index, f)
+            os.replace(temporary, self.index_path)
+        except OSError:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    def load(self, path, min_size=256):
+        """Return the pyramid levels of `path` as PIL images, largest first
+
+        Cached levels are memory-mapped from disk; on a miss the file is decoded,
+        normalized and stored first.
+        """
+        digest = self.digest(path)
+        levels = self._read(digest)
+        instrumentation.count('image_cache.hit' if levels is not None else 'image_cache.miss')
+        if levels is None:
+            image, _ = open_cephalogram(path)
+            pyramid = ImagePyramid(image, min_size)
+            del image
+            self._write(digest, pyramid.levels, path)
+            # Swap the decoded levels for their memory maps so only the pages in use stay resident
+            levels = self._read(digest) or pyramid.levels
+        return levels
+
+    def _read(self, digest):
+        entry = self._entry_dir(digest)
+        meta_path = os.path.join(entry, 'meta.json')
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('format_version') != CACHE_FORMAT_VERSION:
+                return None
+            arrays = [np.load(os.path.join(entry, f'level_{i}.npy'), mmap_mode='r')
+                      for i in range(meta['levels'])]
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # The entry's modification time records its last use for LRU eviction
+        os.utime(meta_path)
+        return [Image.fromarray(array) for array in arrays]
+
+    def _write(self, digest, levels, source):
+        entry = self._entry_dir(digest)
+        temporary = f"{entry}.tmp{os.getpid()}_{threading.get_ident()}"
+        os.makedirs(temporary, exist_ok=True)
+        try:
+            for i, level in enumerate(levels):
+                np.save(os.path.join(temporary, f'level_{i}.npy'), np.asarray(level))
+            with open(os.path.join(temporary, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({'format_version': CACHE_FORMAT_VERSION, 'levels': len(levels),
+                           'size': list(levels[0].size), 'source': os.path.basename(source),
+                           'created': time.time()}, f)
+            # An entry left half-deleted would block publishing forever, so replace it
+            if os.path.exists(entry) and not self._complete(entry):
+                self._discard(entry)
+            # Publish the entry in one step; another thread may have stored it meanwhile
+            os.replace(temporary, entry)
+        except OSError:
+            shutil.rmtree(temporary, ignore_errors=True)
+            return
+        self.evict(keep=digest)
+
+    def _complete(self, entry):
+        """Whether an entry directory has valid metadata and every level file it lists"""
+        try:
+            with open(os.path.join(entry, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            return (meta.get('format_version') == CACHE_FORMAT_VERSION and
+                    all(os.path.exists(os.path.join(entry, f'level_{i}.npy')) for i in range(meta['levels'])))
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def _discard(self, entry):
+        """Delete an entry directory; returns False, leaving it intact, if it is still in use
+
+        The entry is first renamed out of the way in one step. On Windows that fails while
+        any of its levels is memory-mapped, where deleting the files one by one would
+        instead remove the unmapped ones and leave a broken entry behind.
+        """
+        tombstone = f"{entry}.evict{os.getpid()}_{threading.get_ident()}"
+        try:
+            os.rename(entry, tombstone)
+        except OSError:
+            return False
+        shutil.rmtree(tombstone, ignore_errors=True)
+        return True
+
+    def _remove_tombstones(self):
+        """Retry deleting entries that were renamed for eviction but not fully removed"""
+        for prefix in os.listdir(self.directory):
+            prefix_dir = os.path.join(self.directory, prefix)
+            if len(prefix) == 2 and os.path.isdir(prefix_dir):
+                for name in os.listdir(prefix_dir):
+                    if '.evict' in name:
+                        shutil.rmtree(os.path.join(prefix_dir, name), ignore_errors=True)
+
+    def entries(self):
+        """(last use, bytes, entry directory, digest) of every cache entry"""
+        entries = []
+        for prefix in os.listdir(self.directory):
+            prefix_dir = os.path.join(self.directory, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+            for digest in os.listdir(prefix_dir):
+                if '.' in digest:
+                    continue  # Entry still being written
+                entry = os.path.join(prefix_dir, digest)
+                try:
+                    used = os.path.getmtime(os.path.join(entry, 'meta.json'))
+                    size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+                except OSError:
+                    continue
+                entries.append((used, size, entry, digest))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _, _ in self.entries())
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in `max_bytes`
+
+        Entries that are still memory-mapped somewhere cannot be removed and are skipped.
+        """
+        self._remove_tombstones()
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _, _ in entries)
+        evicted = set()
+        for _, size, entry, digest in entries:
+            if total <= self.max_bytes:
+                break
+            if digest == keep or not self._discard(entry):
+                continue
+            evicted.add(digest)
+            total -= size
+
+        # Forget the source files of evicted entries so the index does not grow without bound
+        if evicted:
+            with self._lock:
+                self._index = {key: digest for key, digest in self._index.items() if digest not in evicted}
+                self._save_index()
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory, exist_ok=True)
+            self._index = {}
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def default_cache():
+    """The cache shared by the GUI and the worklist, created on first use"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ImageCache()
+        return _default_cache
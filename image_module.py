@@ -0,0 +1,188 @@
+import math
+import os
+import numpy as np
+from PIL import ExifTags, Image
+
+# File types opened as cephalograms by the GUI, the worklist and the command line tools
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+# Modes that Tk can display directly
+DISPLAY_MODES = ('L', 'RGB', 'RGBA')
+
+# Modes holding more than 8 bits per pixel
+HIGH_BIT_DEPTH_MODES = ('I;16', 'I;16L', 'I;16B', 'I;16N', 'I', 'F')
+
+# EXIF orientation -> transpose that makes the image upright
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def to_8bit(image, window=None, rows=256):
+    """Map a high bit depth image to 8 bits, `rows` rows at a time
+
+    `window` is the (low, high) intensity range stretched over 0-255 and defaults to the
+    range the image uses. Only one strip is ever converted to float, so the extra memory
+    is a few MB instead of four bytes per pixel of the whole radiograph.
+    """
+    low, high = window or image.getextrema()
+    scale = 255.0 / (high - low) if high > low else 0.0
+    width, height = image.size
+    pixels = np.empty((height, width), dtype=np.uint8)
+    for top in range(0, height, rows):
+        bottom = min(height, top + rows)
+        strip = np.asarray(image.crop((0, top, width, bottom)), dtype=np.float32)
+        np.clip((strip - low) * scale, 0, 255, out=strip)
+        pixels[top:bottom] = strip
+    return Image.fromarray(pixels)
+
+
+def find_images(directory):
+    """Sorted paths of the cephalograms in `directory`"""
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def open_cephalogram(path, max_size=None):
+    """Decode a cephalogram as an upright 8-bit grayscale image
+
+    JPEGs are decoded straight to grayscale and, when `max_size` is given, at the smallest
+    reduced scale that still covers `max_size` on the longest side. Returns the image and
+    the upright full-resolution size.
+    """
+    with Image.open(path) as image:
+        orientation = image.getexif().get(ExifTags.Base.Orientation)
+        full_size = image.size
+        draft_size = None
+        if max_size is not None and max(full_size) > max_size:
+            scale = max_size / max(full_size)
+            draft_size = (max(1, round(full_size[0] * scale)), max(1, round(full_size[1] * scale)))
+        image.draft('L', draft_size)
+        image.load()
+        if image.mode in HIGH_BIT_DEPTH_MODES:
+            image = to_8bit(image)
+        elif image.mode != 'L':
+            image = image.convert('L')
+
+    # Orient after the reduction so the transpose only touches 8-bit pixels
+    if orientation in ORIENTATION_TRANSPOSE:
+        image = image.transpose(ORIENTATION_TRANSPOSE[orientation])
+        if orientation >= 5:
+            full_size = full_size[::-1]
+    return image, full_size
+
+
+class ImagePyramid:
+    """Multi-resolution copies of a cephalogram, each level half the size of the previous one"""
+
+    def __init__(self, image, min_size=256):
+        if image.mode not in DISPLAY_MODES:
+            image = image.convert('RGB')
+        self.size = image.size
+        self.levels = [image]
+
+        # Halve until the smallest level fits comfortably in any canvas
+        while max(self.levels[-1].size) // 2 >= min_size:
+            self.levels.append(self.levels[-1].reduce(2))
+
+    @classmethod
+    def from_levels(cls, levels):
+        """Wrap levels that were computed earlier, largest first"""
+        pyramid = cls.__new__(cls)
+        pyramid.size = levels[0].size
+        pyramid.levels = list(levels)
+        return pyramid
+
+    def level_for_scale(self, scale):
+        """Return the index of the smallest level that still has at least `scale` detail"""
+        if scale >= 1:
+            return 0
+        level = int(math.floor(math.log2(1 / scale)))
+        return min(level, len(self.levels) - 1)
+
+    def render(self, scale, box, resample=Image.BILINEAR):
+        """Resample the full-resolution region `box` to screen pixels at `scale`
+
+        `box` is (left, top, right, bottom) in full-resolution image coordinates and may
+        be fractional. Only that region of the nearest pyramid level is resampled.
+        """
+        source = self.levels[self.level_for_scale(scale)]
+
+        # Level sizes are rounded down when halving, so map the box with the real level size
+        fx = source.size[0] / self.size[0]
+        fy = source.size[1] / self.size[1]
+        level_box = (box[0] * fx, box[1] * fy, box[2] * fx, box[3] * fy)
+
+        out_width = max(1, int(round((box[2] - box[0]) * scale)))
+        out_height = max(1, int(round((box[3] - box[1]) * scale)))
+        return source.resize((out_width, out_height), resample, box=level_box)
+
+
+class Viewport:
+    """Zoom and pan state mapping between canvas and full-resolution image coordinates"""
+
+    def __init__(self, image_size, canvas_size, max_zoom=16.0):
+        self.image_size = image_size
+        self.canvas_size = canvas_size
+        self.max_zoom = max_zoom
+        self.fit()
+
+    def fit(self):
+        """Scale the whole image to fit the canvas and centre it"""
+        img_width, img_height = self.image_size
+        canvas_width, canvas_height = self.canvas_size
+        self.fit_scale = min(canvas_width / img_width, canvas_height / img_height)
+        self.scale = self.fit_scale
+        self.offset_x = (canvas_width - img_width * self.scale) / 2
+        self.offset_y = (canvas_height - img_height * self.scale) / 2
+
+    def resize(self, canvas_size):
+        """Keep the image point at the canvas centre fixed when the canvas is resized"""
+        centre = self.canvas_to_image(self.canvas_size[0] / 2, self.canvas_size[1] / 2)
+        zoom = self.scale / self.fit_scale
+        self.canvas_size = canvas_size
+        self.fit()
+        self.scale = self.fit_scale * zoom
+        self.offset_x = canvas_size[0] / 2 - centre[0] * self.scale
+        self.offset_y = canvas_size[1] / 2 - centre[1] * self.scale
+
+    def canvas_to_image(self, canvas_x, canvas_y):
+        return ((canvas_x - self.offset_x) / self.scale,
+                (canvas_y - self.offset_y) / self.scale)
+
+    def image_to_canvas(self, img_x, img_y):
+        return (img_x * self.scale + self.offset_x,
+                img_y * self.scale + self.offset_y)
+
+    def zoom(self, factor, canvas_x, canvas_y):
+        """Zoom by `factor` keeping the image point under (canvas_x, canvas_y) fixed"""
+        img_x, img_y = self.canvas_to_image(canvas_x, canvas_y)
+        zoom = self.scale * factor / self.fit_scale
+        zoom = max(1.0, min(self.max_zoom, zoom))
+        self.scale = self.fit_scale * zoom
+        self.offset_x = canvas_x - img_x * self.scale
+        self.offset_y = canvas_y - img_y * self.scale
+
+    def pan(self, dx, dy):
+        self.offset_x += dx
+        self.offset_y += dy
+
+    def visible_region(self):
+        """Return the canvas position and image box of the visible part, or None if off-screen"""
+        img_width, img_height = self.image_size
+        canvas_width, canvas_height = self.canvas_size
+        img_left, img_top = self.canvas_to_image(0, 0)
+        img_right, img_bottom = self.canvas_to_image(canvas_width, canvas_height)
+        box = (max(0.0, img_left), max(0.0, img_top),
+               min(float(img_width), img_right), min(float(img_height), img_bottom))
+        if box[2] <= box[0] or box[3] <= box[1]:
+            return None
+
+        # The tile is anchored at the exact canvas position of the box corner
+        return self.image_to_canvas(box[0], box[1]), box
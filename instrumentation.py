@@ -0,0 +1,173 @@
+"""Switchable timing spans and counters for the application's hot paths.
+
+Instrumentation is off by default (set CEPH_PROFILE=1 or call set_enabled(True)). While
+it is off, `span()` returns a shared no-op context manager and `count()` returns at once,
+so the calls can stay in hot paths. While it is on, finished spans are kept in a bounded
+buffer for export in the Chrome trace event format (chrome://tracing, Perfetto), and a
+rolling per-name summary is kept for the diagnostics panel.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+_enabled = os.environ.get('CEPH_PROFILE', '') not in ('', '0')
+_lock = threading.Lock()
+_events = deque(maxlen=100000)
+_recent = {}
+_totals = {}
+_counters = {}
+_origin_ns = time.perf_counter_ns()
+
+# Durations kept per span name for the rolling percentiles
+RECENT_SPANS = 512
+
+
+def set_enabled(enabled):
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def is_enabled():
+    return _enabled
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        _record(self.name, self.start, end - self.start, self.args)
+        return False
+
+
+def span(name, **args):
+    """Context manager timing the enclosed block under `name` while instrumentation is on"""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+
+def timed(name):
+    """Decorator form of `span`"""
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Span(name, None):
+                return function(*args, **kwargs)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        wrapper.__wrapped__ = function
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    """Add `n` to a named counter while instrumentation is on"""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def _record(name, start_ns, duration_ns, args):
+    with _lock:
+        _events.append((name, start_ns, duration_ns, threading.get_ident(), args))
+        recent = _recent.get(name)
+        if recent is None:
+            recent = _recent[name] = deque(maxlen=RECENT_SPANS)
+            _totals[name] = [0, 0, 0]
+        recent.append(duration_ns)
+        totals = _totals[name]
+        totals[0] += 1
+        totals[1] += duration_ns
+        totals[2] = max(totals[2], duration_ns)
+
+
+def summary():
+    """Per-span statistics (all times in ms; percentiles over recent spans) and counter values"""
+    with _lock:
+        recent = {name: np.array(durations) / 1e6 for name, durations in _recent.items()}
+        totals = {name: list(values) for name, values in _totals.items()}
+        counters = dict(_counters)
+
+    spans = {}
+    for name, durations in sorted(recent.items()):
+        calls, total_ns, max_ns = totals[name]
+        spans[name] = {
+            'count': calls,
+            'mean_ms': total_ns / calls / 1e6,
+            'p50_ms': float(np.percentile(durations, 50)),
+            'p95_ms': float(np.percentile(durations, 95)),
+            'max_ms': max_ns / 1e6,
+        }
+    return {'spans': spans, 'counters': counters}
+
+
+def format_summary():
+    """Plain-text table of `summary()` for the diagnostics panel"""
+    data = summary()
+    lines = [f"{'span':34s} {'count':>7s} {'mean':>9s} {'p50':>9s} {'p95':>9s} {'max':>9s}"]
+    for name, stats in data['spans'].items():
+        lines.append(f"{name:34s} {stats['count']:7d} {stats['mean_ms']:9.2f} {stats['p50_ms']:9.2f} "
+                     f"{stats['p95_ms']:9.2f} {stats['max_ms']:9.2f}")
+    if data['counters']:
+        lines.append("")
+        lines.append("counters")
+        for name, value in sorted(data['counters'].items()):
+            lines.append(f"  {name:32s} {value}")
+    return "\n".join(lines)
+
+
+def export_chrome_trace(path):
+    """Write the buffered spans and current counters as a Chrome trace event JSON file"""
+    with _lock:
+        events = list(_events)
+        counters = dict(_counters)
+
+    pid = os.getpid()
+    trace = []
+    for name, start_ns, duration_ns, tid, args in events:
+        event = {'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                 'ts': (start_ns - _origin_ns) / 1000, 'dur': duration_ns / 1000}
+        if args:
+            event['args'] = args
+        trace.append(event)
+    now = (time.perf_counter_ns() - _origin_ns) / 1000
+    for name, value in counters.items():
+        trace.append({'name': name, 'ph': 'C', 'pid': pid, 'tid': 0, 'ts': now, 'args': {'value': value}})
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+    return len(trace)
+
+
+def reset():
+    with _lock:
+        _events.clear()
+        _recent.clear()
+        _totals.clear()
+        _counters.clear()
@@ -0,0 +1,88 @@
+import numpy as np
+from steiner_module import LANDMARK_INDEX, LANDMARK_NAMES
+
+
+class LandmarkSet:
+    """One tracing as a float32 (19, 2) array in canonical landmark order, NaN where missing
+
+    The array may be a view into a stacked (N, 19, 2) batch, so batches are built and
+    serialized without copying per case. Conversion to and from the GUI's landmarks
+    dictionary ({name: {'x': x or None, 'y': y or None}}) is by canonical index, so the
+    order in which a dictionary was built never matters.
+    """
+
+    __slots__ = ('points',)
+
+    def __init__(self, points=None):
+        if points is None:
+            self.points = np.full((len(LANDMARK_NAMES), 2), np.nan, dtype=np.float32)
+        else:
+            self.points = np.asarray(points, dtype=np.float32).reshape(len(LANDMARK_NAMES), 2)
+
+    @classmethod
+    def from_dict(cls, landmarks):
+        landmark_set = cls()
+        for name, pos in landmarks.items():
+            if pos['x'] is not None and pos['y'] is not None:
+                landmark_set.points[LANDMARK_INDEX[name]] = (pos['x'], pos['y'])
+        return landmark_set
+
+    @classmethod
+    def coerce(cls, landmarks):
+        """Return `landmarks` as a LandmarkSet, converting a GUI dictionary or a (19, 2) array"""
+        if isinstance(landmarks, cls):
+            return landmarks
+        if isinstance(landmarks, dict):
+            return cls.from_dict(landmarks)
+        return cls(landmarks)
+
+    def to_dict(self, decimals=None):
+        """GUI landmarks dictionary in canonical order, with None for missing coordinates
+
+        `decimals` rounds the coordinates, which also drops the float32 representation error
+        from values that were entered with that many decimals.
+        """
+        points = self.points.astype(np.float64)
+        if decimals is not None:
+            points = points.round(decimals)
+        return {name: ({'x': None, 'y': None} if np.isnan(x) or np.isnan(y) else {'x': x, 'y': y})
+                for name, (x, y) in zip(LANDMARK_NAMES, points.tolist())}
+
+    @property
+    def missing(self):
+        """Boolean (19,) mask of landmarks that are not placed"""
+        return np.isnan(self.points).any(axis=1)
+
+    def __getitem__(self, name):
+        x, y = self.points[LANDMARK_INDEX[name]].tolist()
+        return None if np.isnan(x) or np.isnan(y) else (x, y)
+
+    def __setitem__(self, name, point):
+        self.points[LANDMARK_INDEX[name]] = (np.nan, np.nan) if point is None else point
+
+    def __array__(self, dtype=None, copy=None):
+        return self.points if dtype is None else self.points.astype(dtype)
+
+    def copy(self):
+        return LandmarkSet(self.points.copy())
+
+    def features(self):
+        """ML feature vector: (38,) float64 coordinates in canonical order, 0 for missing landmarks"""
+        return landmark_features(self.points)
+
+    def __repr__(self):
+        return f"LandmarkSet({len(LANDMARK_NAMES) - int(self.missing.sum())}/{len(LANDMARK_NAMES)} placed)"
+
+
+def stack_landmark_sets(landmark_sets):
+    """One contiguous float32 (N, 19, 2) array from landmark sets, GUI dictionaries or arrays"""
+    batch = np.empty((len(landmark_sets), len(LANDMARK_NAMES), 2), dtype=np.float32)
+    for i, landmarks in enumerate(landmark_sets):
+        batch[i] = LandmarkSet.coerce(landmarks).points
+    return batch
+
+
+def landmark_features(points):
+    """ML features for (..., 19, 2) points: (..., 38) float64 with 0 for missing landmarks"""
+    points = np.asarray(points, dtype=np.float64)
+    return np.nan_to_num(points, nan=0.0).reshape(*points.shape[:-2], 2 * len(LANDMARK_NAMES))
@@ -1,9 +1,18 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-from PIL import Image, ImageTk, ImageDraw
-import math
+from PIL import ImageTk
 import os
-from ml_module import CephalometricML
+import queue
+import sys
+import threading
+import numpy as np
+import instrumentation
+from image_module import IMAGE_EXTENSIONS, Viewport
+from worklist_module import CaseWorklist, load_case
+from measurement_graph import build_steiner_graph
+from landmark_set import LandmarkSet
+from steiner_module import (LANDMARK_INDEX, LANDMARK_NAMES, MEASUREMENT_NAMES, REQUIRED_LANDMARKS,
+                            angle_between_lines, describe_interpretation)
 
 class SteinerAnalysisApp:
     def __init__(self, root):
@@ -11,35 +20,19 @@ class SteinerAnalysisApp:
         self.root.title("Steiner's Cephalometric Analysis Software")
         self.root.geometry("1200x800")
         
-        # Initialize ML module
-        self.ml_module = CephalometricML()
+        # The ML module is imported and its model loaded in the background once the window is up
+        self.ml_module = None
+        self.ml_events = queue.Queue()
         
         # Initialize landmarks dictionary
-        self.landmarks = {
-            'Sella (S)': {'x': None, 'y': None},
-            'Nasion (N)': {'x': None, 'y': None},
-            'Orbitale (Or)': {'x': None, 'y': None},
-            'Porion (Po)': {'x': None, 'y': None},
-            'Subspinale (A Point)': {'x': None, 'y': None},
-            'Supramentale (B Point)': {'x': None, 'y': None},
-            'Pogonion (Pg)': {'x': None, 'y': None},
-            'Menton (Me)': {'x': None, 'y': None},
-            'Gnathion (Gn)': {'x': None, 'y': None},
-            'Gonion (Go)': {'x': None, 'y': None},
-            'Incision Inferius (II)': {'x': None, 'y': None},
-            'Incision Superius (IS)': {'x': None, 'y': None},
-            'Upper lip': {'x': None, 'y': None},
-            'Lower lip': {'x': None, 'y': None},
-            'Subnasale (Sn)': {'x': None, 'y': None},
-            'Soft tissue Pogonion (Pog\')': {'x': None, 'y': None},
-            'Posterior Nasal Spine (PNS)': {'x': None, 'y': None},
-            'Anterior Nasal Spine (ANS)': {'x': None, 'y': None},
-            'Articulare (Ar)': {'x': None, 'y': None}
-        }
+        self.landmarks = {name: {'x': None, 'y': None} for name in LANDMARK_NAMES}
         
         # Store current measurements
         self.current_measurements = None
         
+        # Memoized measurement graph; only results downstream of a moved landmark are recomputed
+        self.measurement_graph = build_steiner_graph()
+        
         # Create notebook for tabs
         self.notebook = ttk.Notebook(root)
         self.notebook.pack(fill=tk.BOTH, expand=True)
@@ -49,24 +42,69 @@ class SteinerAnalysisApp:
         self.analysis_frame = ttk.Frame(self.notebook)
         self.interpretation_frame = ttk.Frame(self.notebook)
         self.ml_frame = ttk.Frame(self.notebook)  # New ML training tab
+        self.diagnostics_frame = ttk.Frame(self.notebook)
         
         self.notebook.add(self.image_frame, text="Image & Landmarks")
         self.notebook.add(self.analysis_frame, text="Steiner's Analysis")
         self.notebook.add(self.interpretation_frame, text="Interpretation Guide")
         self.notebook.add(self.ml_frame, text="ML Training")  # Add ML tab
+        self.notebook.add(self.diagnostics_frame, text="Diagnostics")
         
         # Build each tab
         self.create_image_tab()
         self.create_analysis_tab()
         self.create_interpretation_tab()
         self.create_ml_tab()  # Create ML tab
+        self.create_diagnostics_tab()
         
         # Load default image (optional)
         self.current_image = None
         self.photo = None
-        self.landmark_buttons = []
-        self.scale_x = 1.0
-        self.scale_y = 1.0
+        self.landmark_items = {}
+        self.pyramid = None
+        self.viewport = None
+        self.canvas_image = None
+        self.pan_start = None
+        self.detector = None
+        self.worklist = None
+        self.worklist_landmarks = {}
+        self.export_events = queue.Queue()
+        
+        # Start loading the ML subsystem after the window has been drawn
+        self.root.after(100, self.start_ml_loading)
+
+    def start_ml_loading(self):
+        threading.Thread(target=self.load_ml_module, daemon=True).start()
+        self.root.after(100, self.poll_ml_loading)
+
+    def load_ml_module(self):
+        """Worker thread body: import the ML module and load the saved model"""
+        try:
+            from ml_module import CephalometricML
+            self.ml_events.put((CephalometricML(), None))
+        except Exception as e:
+            self.ml_events.put((None, str(e)))
+
+    def poll_ml_loading(self):
+        try:
+            ml_module, error = self.ml_events.get_nowait()
+        except queue.Empty:
+            self.root.after(100, self.poll_ml_loading)
+            return
+        
+        if error is not None:
+            self.ml_state_label.configure(text=f"ML model: failed to load ({error})", foreground='red')
+            return
+        
+        self.ml_module = ml_module
+        self.refit_interval_var.set(ml_module.full_refit_interval)
+        self.set_ml_buttons_enabled(True)
+        self.ml_state_label.configure(text="ML model: ready", foreground='green')
+
+    def set_ml_buttons_enabled(self, enabled):
+        """Buttons that change the training data or the model are disabled while a run uses them"""
+        for button in self.ml_buttons:
+            button.state(['!disabled' if enabled else 'disabled'])
 
     def create_image_tab(self):
         # Left panel for image display
@@ -77,6 +115,15 @@ class SteinerAnalysisApp:
         self.image_canvas = tk.Canvas(left_panel, bg='gray', width=600, height=700)
         self.image_canvas.pack(fill=tk.BOTH, expand=True)
         
+        # Zoom with the mouse wheel, pan by dragging with the right or middle button
+        self.image_canvas.bind("<MouseWheel>", self.on_zoom)
+        self.image_canvas.bind("<Button-4>", self.on_zoom)
+        self.image_canvas.bind("<Button-5>", self.on_zoom)
+        for button in (2, 3):
+            self.image_canvas.bind(f"<ButtonPress-{button}>", self.on_pan_start)
+            self.image_canvas.bind(f"<B{button}-Motion>", self.on_pan_move)
+        self.image_canvas.bind("<Configure>", self.on_canvas_resize)
+        
         # Right panel for controls
         right_panel = ttk.Frame(self.image_frame, width=300)
         right_panel.pack(side=tk.RIGHT, fill=tk.Y, padx=5, pady=5)
@@ -85,10 +132,30 @@ class SteinerAnalysisApp:
         upload_btn = ttk.Button(right_panel, text="Upload Cephalogram", command=self.upload_image)
         upload_btn.pack(fill=tk.X, pady=5)
         
+        # Worklist of cases decoded ahead of time
+        worklist_btn = ttk.Button(right_panel, text="Open Worklist Folder", command=self.open_worklist)
+        worklist_btn.pack(fill=tk.X, pady=5)
+        nav_frame = ttk.Frame(right_panel)
+        nav_frame.pack(fill=tk.X)
+        ttk.Button(nav_frame, text="< Previous Case", command=self.previous_case).pack(side=tk.LEFT, expand=True, fill=tk.X)
+        ttk.Button(nav_frame, text="Next Case >", command=self.next_case).pack(side=tk.LEFT, expand=True, fill=tk.X)
+        self.case_label = ttk.Label(right_panel, text="")
+        self.case_label.pack(fill=tk.X)
+        export_btn = ttk.Button(right_panel, text="Export Worklist Reports", command=self.export_worklist_reports)
+        export_btn.pack(fill=tk.X, pady=5)
+        
         # Auto-detect button
         detect_btn = ttk.Button(right_panel, text="Auto-Detect Landmarks", command=self.auto_detect_landmarks)
         detect_btn.pack(fill=tk.X, pady=5)
         
+        # Teach the detector from the current tracing
+        add_tracing_btn = ttk.Button(right_panel, text="Add Tracing to Detector", command=self.add_detector_tracing)
+        add_tracing_btn.pack(fill=tk.X, pady=5)
+        
+        # Reset zoom and pan
+        reset_view_btn = ttk.Button(right_panel, text="Fit Image to Window", command=self.reset_view)
+        reset_view_btn.pack(fill=tk.X, pady=5)
+        
         # Manual landmark selection
         ttk.Label(right_panel, text="Manual Landmark Selection:").pack(pady=(10, 0))
         
@@ -109,6 +176,12 @@ class SteinerAnalysisApp:
         ttk.Label(right_panel, text="Landmark Status:").pack(pady=(10, 0))
         self.landmark_status = tk.Text(right_panel, height=10, width=30)
         self.landmark_status.pack(fill=tk.BOTH, expand=True)
+        self.landmark_status.tag_config("green", foreground="green")
+        self.landmark_status.tag_config("red", foreground="red")
+        
+        # Live skeletal measurements while landmarks are placed or dragged
+        self.live_measurements = ttk.Label(right_panel, text="")
+        self.live_measurements.pack(fill=tk.X, pady=(5, 0))
         
         # Update status
         self.update_landmark_status()
@@ -165,44 +238,230 @@ class SteinerAnalysisApp:
         ttk.Label(skeletal_frame, text="Low (<78°): Retrognathic mandible", foreground='red').pack(anchor='w')
 
     def upload_image(self):
-        file_path = filedialog.askopenfilename(filetypes=[("Image files", "*.jpg *.jpeg *.png *.bmp")])
+        file_path = filedialog.askopenfilename(
+            filetypes=[("Image files", " ".join('*' + extension for extension in IMAGE_EXTENSIONS))])
         if file_path:
-            self.current_image = Image.open(file_path)
-            self.display_image()
+            # Decoded once and cached on disk; reopening maps the image and its pyramid from the cache
+            try:
+                case = load_case(file_path)
+            except Exception as e:
+                messagebox.showerror("Error", f"Could not open the image: {e}")
+                return
+            # A single image replaces the worklist, so navigation no longer applies
+            self.close_worklist()
+            self.show_case(case.image, case.pyramid)
             self.clear_landmarks()
 
+    def show_case(self, image, pyramid):
+        self.current_image = image
+        self.pyramid = pyramid
+        self.viewport = None
+        self.display_image()
+
+    def open_worklist(self):
+        folder = filedialog.askdirectory(title="Select a folder of cephalograms")
+        if not folder:
+            return
+        worklist = CaseWorklist.from_folder(folder)
+        if not len(worklist):
+            messagebox.showerror("Error", "No images found in the selected folder")
+            return
+        # Keep the open case, its tracing and the previous worklist until the first case loads
+        try:
+            with instrumentation.span('worklist.navigate'):
+                case = worklist.current()
+        except Exception as e:
+            worklist.close()
+            messagebox.showerror("Error", f"Could not open the case: {e}")
+            return
+        self.close_worklist()
+        self.worklist = worklist
+        self.clear_landmarks()
+        self.show_worklist_case(case)
+
+    def close_worklist(self):
+        """Stop prefetching and forget the worklist and its saved tracings"""
+        if self.worklist is not None:
+            self.worklist.close()
+        self.worklist = None
+        self.worklist_landmarks = {}
+        self.case_label.configure(text="")
+
+    def load_worklist_case(self, navigate):
+        """Remember the current tracing, move through the worklist and restore that case's tracing
+
+        If the case cannot be loaded, the error is shown and the previous case stays current.
+        """
+        self.worklist_landmarks[self.worklist.index] = LandmarkSet.from_dict(self.landmarks)
+        try:
+            with instrumentation.span('worklist.navigate'):
+                case = navigate()
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not open the case: {e}")
+            return
+        self.show_worklist_case(case)
+
+    def show_worklist_case(self, case):
+        """Display the current worklist case with its saved tracing, if any"""
+        self.show_case(case.image, case.pyramid)
+        
+        saved = self.worklist_landmarks.get(self.worklist.index, LandmarkSet())
+        self.landmarks.update(saved.to_dict(decimals=2))
+        self.update_landmark_display()
+        self.update_landmark_status(list(LANDMARK_NAMES))
+        self.update_live_measurements()
+        self.case_label.configure(
+            text=f"Case {self.worklist.index + 1}/{len(self.worklist)}: {os.path.basename(case.path)}")
+
+    def next_case(self):
+        if self.worklist is not None and self.worklist.has_next():
+            self.load_worklist_case(self.worklist.next)
+
+    def previous_case(self):
+        if self.worklist is not None and self.worklist.has_previous():
+            self.load_worklist_case(self.worklist.previous)
+
+    def export_worklist_reports(self):
+        """Write an annotated PNG and PDF report for every traced case, plus one combined PDF"""
+        if self.worklist is None:
+            messagebox.showerror("Error", "Please open a worklist first")
+            return
+        output_dir = filedialog.askdirectory(title="Select a folder for the reports")
+        if not output_dir:
+            return
+        
+        # Include the tracing currently on screen
+        self.worklist_landmarks[self.worklist.index] = LandmarkSet.from_dict(self.landmarks)
+        cases = [(path, self.worklist_landmarks[i].points) for i, path in enumerate(self.worklist.paths)
+                 if i in self.worklist_landmarks and not self.worklist_landmarks[i].missing.all()]
+        if not cases:
+            messagebox.showerror("Error", "No traced cases to export")
+            return
+        
+        threading.Thread(target=self.run_report_export, args=(cases, output_dir), daemon=True).start()
+        self.root.after(100, self.poll_report_export)
+
+    def run_report_export(self, cases, output_dir):
+        """Worker thread body: render the reports on a process pool"""
+        from report_export import export_reports
+        try:
+            _, errors = export_reports(cases, output_dir, ('png', 'pdf'),
+                                       combined_pdf=os.path.join(output_dir, 'worklist_reports.pdf'))
+            self.export_events.put((len(cases) - len(errors), errors, None))
+        except Exception as e:
+            self.export_events.put((0, {}, str(e)))
+
+    def poll_report_export(self):
+        try:
+            exported, errors, failure = self.export_events.get_nowait()
+        except queue.Empty:
+            self.root.after(100, self.poll_report_export)
+            return
+        
+        if failure is not None:
+            messagebox.showerror("Error", f"Report export failed: {failure}")
+        elif errors:
+            messagebox.showwarning("Warning", f"Exported {exported} reports; failed:\n" +
+                                   "\n".join(f"{os.path.basename(path)}: {error}" for path, error in errors.items()))
+        else:
+            messagebox.showinfo("Success", f"Exported {exported} reports")
+
     def display_image(self):
-        if self.current_image:
-            # Clear previous landmarks
-            for btn in self.landmark_buttons:
-                self.image_canvas.delete(btn)
-            self.landmark_buttons = []
-            
-            # Resize image to fit canvas
-            canvas_width = self.image_canvas.winfo_width()
-            canvas_height = self.image_canvas.winfo_height()
-            
-            # Get image dimensions
-            img_width, img_height = self.current_image.size
-            
-            # Calculate scaling factors
-            ratio = min(canvas_width/img_width, canvas_height/img_height)
-            new_width = int(img_width * ratio)
-            new_height = int(img_height * ratio)
-            
-            # Resize image
-            resized_image = self.current_image.resize((new_width, new_height), Image.LANCZOS)
-            self.photo = ImageTk.PhotoImage(resized_image)
-            
-            # Display image
-            self.image_canvas.create_image(canvas_width//2, canvas_height//2, anchor=tk.CENTER, image=self.photo)
-            
-            # Store scaling factors
-            self.scale_x = new_width / img_width
-            self.scale_y = new_height / img_height
+        if self.pyramid is None:
+            return
+        
+        canvas_size = (self.image_canvas.winfo_width(), self.image_canvas.winfo_height())
+        if self.viewport is None:
+            self.viewport = Viewport(self.pyramid.size, canvas_size)
+        
+        # Resample only the visible region from the nearest pyramid level
+        region = self.viewport.visible_region()
+        if region is None:
+            if self.canvas_image is not None:
+                self.image_canvas.itemconfigure(self.canvas_image, state=tk.HIDDEN)
+            return
+        (tile_x, tile_y), box = region
+        with instrumentation.span('image.render'):
+            self.photo = ImageTk.PhotoImage(self.pyramid.render(self.viewport.scale, box))
+        
+        if self.canvas_image is None:
+            self.canvas_image = self.image_canvas.create_image(tile_x, tile_y, anchor=tk.NW, image=self.photo)
+            self.image_canvas.tag_lower(self.canvas_image)
+        else:
+            self.image_canvas.coords(self.canvas_image, tile_x, tile_y)
+            self.image_canvas.itemconfigure(self.canvas_image, image=self.photo, state=tk.NORMAL)
+        
+        self.update_landmark_display()
+
+    def reset_view(self):
+        if self.viewport is not None:
+            self.viewport.fit()
+            self.display_image()
+
+    def on_canvas_resize(self, event):
+        if self.viewport is not None:
+            self.viewport.resize((event.width, event.height))
+            self.display_image()
+
+    def on_zoom(self, event):
+        if self.viewport is None:
+            return
+        zoom_in = event.num == 4 or event.delta > 0
+        self.viewport.zoom(1.25 if zoom_in else 0.8, event.x, event.y)
+        self.display_image()
+
+    def on_pan_start(self, event):
+        self.pan_start = (event.x, event.y)
+
+    def on_pan_move(self, event):
+        if self.viewport is None or self.pan_start is None:
+            return
+        self.viewport.pan(event.x - self.pan_start[0], event.y - self.pan_start[1])
+        self.pan_start = (event.x, event.y)
+        self.display_image()
+
+    def get_detector(self):
+        if self.detector is None:
+            from detection_module import LandmarkDetector
+            self.detector = LandmarkDetector.load_or_create()
+        return self.detector
 
     def auto_detect_landmarks(self):
-        messagebox.showinfo("Info", "Auto-detection would be implemented with a trained model in a full implementation")
+        if not self.current_image:
+            messagebox.showerror("Error", "Please upload a cephalogram first")
+            return
+        detector = self.get_detector()
+        if not detector.is_trained():
+            messagebox.showinfo("Info", "The detector has not been trained yet. Trace a few cephalograms "
+                                        "by hand and use 'Add Tracing to Detector' on each of them.")
+            return
+        
+        points, confidence = detector.detect(self.current_image)
+        for name, (x, y) in zip(LANDMARK_NAMES, points):
+            self.landmarks[name]['x'] = round(float(x), 2)
+            self.landmarks[name]['y'] = round(float(y), 2)
+        self.update_landmark_display()
+        self.update_landmark_status(list(LANDMARK_NAMES))
+        self.update_live_measurements()
+        
+        # Point the user at the matches worth checking by hand
+        uncertain = [f"{name} ({score:.2f})" for name, score in zip(LANDMARK_NAMES, confidence) if score < 0.5]
+        if uncertain:
+            messagebox.showwarning("Check Landmarks", "Low-confidence detections:\n" + "\n".join(uncertain))
+
+    def add_detector_tracing(self):
+        if not self.current_image:
+            messagebox.showerror("Error", "Please upload a cephalogram first")
+            return
+        tracing = LandmarkSet.from_dict(self.landmarks)
+        if tracing.missing.all():
+            messagebox.showerror("Error", "Place some landmarks before adding the tracing")
+            return
+        
+        detector = self.get_detector()
+        detector.add_tracing(self.current_image, tracing.points)
+        detector.save()
+        messagebox.showinfo("Info", "Tracing added to the landmark detector")
 
     def prepare_landmark_selection(self):
         landmark_name = self.landmark_var.get()
@@ -211,46 +470,59 @@ class SteinerAnalysisApp:
             messagebox.showinfo("Info", f"Click on the image to set {landmark_name}")
 
     def set_landmark_position(self, event, landmark_name):
-        # Convert canvas coordinates to image coordinates
-        canvas_x = event.x
-        canvas_y = event.y
+        # Convert canvas coordinates to image coordinates, including zoom, pan and centering
+        img_x, img_y = self.viewport.canvas_to_image(event.x, event.y)
         
-        # Calculate image coordinates
-        img_x = int(canvas_x / self.scale_x)
-        img_y = int(canvas_y / self.scale_y)
+        # Ignore clicks outside the image
+        img_width, img_height = self.pyramid.size
+        if not (0 <= img_x < img_width and 0 <= img_y < img_height):
+            return
+        img_x = round(img_x, 2)
+        img_y = round(img_y, 2)
         
         # Update landmark position
         self.landmarks[landmark_name]['x'] = img_x
         self.landmarks[landmark_name]['y'] = img_y
         
-        # Update display
-        self.update_landmark_display()
-        self.update_landmark_status()
+        # Update only the overlay and status row of this landmark
+        self.update_landmark_display([landmark_name])
+        self.update_landmark_status([landmark_name])
+        self.update_live_measurements()
         
         # Unbind the click event
         self.image_canvas.unbind("<Button-1>")
 
     def clear_landmarks(self):
-        for name in self.landmarks:
+        placed = [name for name, pos in self.landmarks.items() if pos['x'] is not None]
+        for name in placed:
             self.landmarks[name]['x'] = None
             self.landmarks[name]['y'] = None
-        self.update_landmark_display()
-        self.update_landmark_status()
+        self.update_landmark_display(placed)
+        self.update_landmark_status(placed)
+        self.update_live_measurements()
 
-    def update_landmark_display(self):
-        # Clear existing landmarks
-        for btn in self.landmark_buttons:
-            self.image_canvas.delete(btn)
-        self.landmark_buttons = []
-        
-        # Draw new landmarks
-        for name, pos in self.landmarks.items():
-            if pos['x'] is not None and pos['y'] is not None:
-                # Scale coordinates to canvas size
-                canvas_x = pos['x'] * self.scale_x
-                canvas_y = pos['y'] * self.scale_y
-                
-                # Draw landmark
+    @instrumentation.timed('overlay.redraw')
+    def update_landmark_display(self, names=None):
+        """Move, show or hide the overlay items of the given landmarks (all after a view change)"""
+        if names is None:
+            names = self.landmarks.keys()
+        
+        for name in names:
+            pos = self.landmarks[name]
+            items = self.landmark_items.get(name)
+            
+            if pos['x'] is None or pos['y'] is None or self.viewport is None:
+                # Hide rather than delete so the items can be reused
+                if items is not None:
+                    for item in items:
+                        self.image_canvas.itemconfigure(item, state=tk.HIDDEN)
+                continue
+            
+            # Map image coordinates to the current zoom and pan
+            canvas_x, canvas_y = self.viewport.image_to_canvas(pos['x'], pos['y'])
+            
+            if items is None:
+                # First placement: create the landmark items once
                 dot = self.image_canvas.create_oval(
                     canvas_x-5, canvas_y-5, canvas_x+5, canvas_y+5,
                     fill='red', outline='black'
@@ -259,124 +531,94 @@ class SteinerAnalysisApp:
                     canvas_x, canvas_y-10,
                     text=name.split(' ')[0], fill='blue', anchor=tk.S
                 )
-                self.landmark_buttons.extend([dot, text])
+                self.landmark_items[name] = (dot, text)
+                
+                # Placed landmarks can be dragged to adjust them
+                for item in (dot, text):
+                    self.image_canvas.tag_bind(item, "<B1-Motion>",
+                                               lambda event, name=name: self.drag_landmark(event, name))
+            else:
+                dot, text = items
+                self.image_canvas.coords(dot, canvas_x-5, canvas_y-5, canvas_x+5, canvas_y+5)
+                self.image_canvas.coords(text, canvas_x, canvas_y-10)
+                self.image_canvas.itemconfigure(dot, state=tk.NORMAL)
+                self.image_canvas.itemconfigure(text, state=tk.NORMAL)
 
-    def update_landmark_status(self):
-        self.landmark_status.delete(1.0, tk.END)
-        for name, pos in self.landmarks.items():
-            status = "✓" if pos['x'] is not None else "✗"
-            color = "green" if pos['x'] is not None else "red"
-            self.landmark_status.insert(tk.END, f"{name}: {status}\n", color)
-            self.landmark_status.tag_config(color, foreground=color)
+    def drag_landmark(self, event, name):
+        img_x, img_y = self.viewport.canvas_to_image(event.x, event.y)
+        img_width, img_height = self.pyramid.size
+        self.landmarks[name]['x'] = round(min(max(img_x, 0), img_width - 1), 2)
+        self.landmarks[name]['y'] = round(min(max(img_y, 0), img_height - 1), 2)
+        self.update_landmark_display([name])
+        self.update_live_measurements()
+
+    def update_live_measurements(self):
+        """Show SNA/SNB/ANB as soon as their landmarks are placed; only moved landmarks are recomputed"""
+        values = self.calculate_steiner_measurements(('SNA', 'SNB', 'ANB'))
+        if any(np.isnan(value) for value in values.values()):
+            self.live_measurements.configure(text="")
+        else:
+            self.live_measurements.configure(
+                text="   ".join(f"{name}: {value:.1f}°" for name, value in values.items()))
+
+    def update_landmark_status(self, names=None):
+        """Rewrite the status rows of the given landmarks (all rows when building the panel)"""
+        if names is None:
+            self.landmark_status.delete(1.0, tk.END)
+            for name, pos in self.landmarks.items():
+                status = "✓" if pos['x'] is not None else "✗"
+                color = "green" if pos['x'] is not None else "red"
+                self.landmark_status.insert(tk.END, f"{name}: {status}\n", color)
+            return
+        
+        for name in names:
+            # Status rows follow the canonical landmark order
+            row = LANDMARK_INDEX[name] + 1
+            placed = self.landmarks[name]['x'] is not None
+            self.landmark_status.delete(f"{row}.0", f"{row}.end")
+            self.landmark_status.insert(f"{row}.0", f"{name}: {'✓' if placed else '✗'}",
+                                        "green" if placed else "red")
 
     def calculate_angle_between_lines(self, v1, v2):
         """Calculate the acute angle between two lines in degrees"""
-        # Calculate dot product
-        dot_product = v1[0] * v2[0] + v1[1] * v2[1]
-        
-        # Calculate magnitudes
-        mag_v1 = math.sqrt(v1[0]**2 + v1[1]**2)
-        mag_v2 = math.sqrt(v2[0]**2 + v2[1]**2)
-        
-        # Avoid division by zero
-        if mag_v1 == 0 or mag_v2 == 0:
-            return 0.0
-        
-        # Calculate cosine of the angle
-        cosine_angle = dot_product / (mag_v1 * mag_v2)
-        cosine_angle = max(-1, min(1, cosine_angle))  # Clamp to avoid numerical errors
-        
-        # Calculate angle in degrees
-        angle = math.degrees(math.acos(cosine_angle))
-        
-        # Return the acute angle (always between 0 and 90 degrees)
-        return min(angle, 180 - angle)
+        return float(angle_between_lines(v1, v2))
+
+    def calculate_steiner_measurements(self, names=MEASUREMENT_NAMES):
+        """Calculate Steiner measurements for the current landmarks, reusing unaffected results"""
+        self.measurement_graph.set_landmarks(self.landmarks)
+        return {name: float(value) for name, value in self.measurement_graph.evaluate(names).items()}
 
     def calculate_sna(self):
-        S = (self.landmarks['Sella (S)']['x'], self.landmarks['Sella (S)']['y'])
-        N = (self.landmarks['Nasion (N)']['x'], self.landmarks['Nasion (N)']['y'])
-        A = (self.landmarks['Subspinale (A Point)']['x'], self.landmarks['Subspinale (A Point)']['y'])
-        
-        # SNA is the angle between SN line and NA line
-        sn_vector = (N[0] - S[0], N[1] - S[1])
-        na_vector = (A[0] - N[0], A[1] - N[1])
-        
-        return self.calculate_angle_between_lines(sn_vector, na_vector)
+        return self.calculate_steiner_measurements(('SNA',))['SNA']
 
     def calculate_snb(self):
-        S = (self.landmarks['Sella (S)']['x'], self.landmarks['Sella (S)']['y'])
-        N = (self.landmarks['Nasion (N)']['x'], self.landmarks['Nasion (N)']['y'])
-        B = (self.landmarks['Supramentale (B Point)']['x'], self.landmarks['Supramentale (B Point)']['y'])
-        
-        # SNB is the angle between SN line and NB line
-        sn_vector = (N[0] - S[0], N[1] - S[1])
-        nb_vector = (B[0] - N[0], B[1] - N[1])
-        
-        return self.calculate_angle_between_lines(sn_vector, nb_vector)
+        return self.calculate_steiner_measurements(('SNB',))['SNB']
 
     def calculate_ui_na_angle(self):
-        N = (self.landmarks['Nasion (N)']['x'], self.landmarks['Nasion (N)']['y'])
-        A = (self.landmarks['Subspinale (A Point)']['x'], self.landmarks['Subspinale (A Point)']['y'])
-        IS = (self.landmarks['Incision Superius (IS)']['x'], self.landmarks['Incision Superius (IS)']['y'])
-        
-        # UI-NA angle is between upper incisor axis and NA line
-        ui_root = (IS[0], IS[1] + 30)  # Estimated root position
-        ui_vector = (IS[0] - ui_root[0], IS[1] - ui_root[1])
-        na_vector = (A[0] - N[0], A[1] - N[1])
-        
-        return self.calculate_angle_between_lines(ui_vector, na_vector)
+        return self.calculate_steiner_measurements(('UI_NA',))['UI_NA']
 
     def calculate_li_nb_angle(self):
-        N = (self.landmarks['Nasion (N)']['x'], self.landmarks['Nasion (N)']['y'])
-        B = (self.landmarks['Supramentale (B Point)']['x'], self.landmarks['Supramentale (B Point)']['y'])
-        II = (self.landmarks['Incision Inferius (II)']['x'], self.landmarks['Incision Inferius (II)']['y'])
-        
-        # LI-NB angle is between lower incisor axis and NB line
-        li_root = (II[0], II[1] - 30)  # Estimated root position
-        li_vector = (II[0] - li_root[0], II[1] - li_root[1])
-        nb_vector = (B[0] - N[0], B[1] - N[1])
-        
-        return self.calculate_angle_between_lines(li_vector, nb_vector)
+        return self.calculate_steiner_measurements(('LI_NB',))['LI_NB']
 
     def calculate_ui_li_angle(self):
-        IS = (self.landmarks['Incision Superius (IS)']['x'], self.landmarks['Incision Superius (IS)']['y'])
-        II = (self.landmarks['Incision Inferius (II)']['x'], self.landmarks['Incision Inferius (II)']['y'])
-        
-        # UI-LI angle is between upper and lower incisor axes
-        ui_root = (IS[0], IS[1] + 30)
-        ui_vector = (IS[0] - ui_root[0], IS[1] - ui_root[1])
-        
-        li_root = (II[0], II[1] - 30)
-        li_vector = (II[0] - li_root[0], II[1] - li_root[1])
-        
-        angle = self.calculate_angle_between_lines(ui_vector, li_vector)
-        return 180 - angle  # Interincisal angle is the supplement
+        return self.calculate_steiner_measurements(('UI_LI',))['UI_LI']
 
+    @instrumentation.timed('analysis')
     def perform_analysis(self):
         # Check if required landmarks are set
-        required_landmarks = ['Sella (S)', 'Nasion (N)', 'Subspinale (A Point)', 
-                             'Supramentale (B Point)', 'Incision Inferius (II)', 
-                             'Incision Superius (IS)']
-        
-        missing = [name for name in required_landmarks if self.landmarks[name]['x'] is None]
+        missing = [name for name in REQUIRED_LANDMARKS if self.landmarks[name]['x'] is None]
         if missing:
             messagebox.showerror("Error", f"Missing required landmarks: {', '.join(missing)}")
             return
             
         try:
-            # Get ML predictions if available
-            ml_predictions = self.ml_module.predict_measurements(self.landmarks)
+            # Get ML predictions if available (None while the ML module is still loading)
+            ml_predictions = None
+            if self.ml_module is not None:
+                ml_predictions = self.ml_module.predict_measurements(self.landmarks)
             
-            # Calculate measurements
-            measurements = {
-                'SNA': self.calculate_sna(),
-                'SNB': self.calculate_snb(),
-                'ANB': None,
-                'UI_NA': self.calculate_ui_na_angle(),
-                'LI_NB': self.calculate_li_nb_angle(),
-                'UI_LI': self.calculate_ui_li_angle()
-            }
-            measurements['ANB'] = measurements['SNA'] - measurements['SNB']
+            # Calculate all measurements in a single vectorized pass
+            measurements = self.calculate_steiner_measurements()
             
             # Store current measurements
             self.current_measurements = measurements
@@ -395,32 +637,21 @@ class SteinerAnalysisApp:
                     results += f" (ML suggested: {ml_value:.1f}°)"
                 results += "\n"
             
+            # Further Steiner measurements, shown when their landmarks are placed
+            extra = self.calculate_steiner_measurements(('GoGn_SN', 'Holdaway_ratio'))
+            if not np.isnan(extra['GoGn_SN']):
+                results += f"GoGn-SN: {extra['GoGn_SN']:.1f}°\n"
+            if not np.isnan(extra['Holdaway_ratio']):
+                results += f"Holdaway ratio (II-NB : Pog-NB): {extra['Holdaway_ratio']:.2f}\n"
+            
+            if self.ml_module is None:
+                results += "\n(ML suggestions are still loading)\n"
+            
             # Add interpretation
             results += "\n=== INTERPRETATION ===\n\n"
             
-            # Skeletal pattern
-            if 0 <= measurements['ANB'] <= 4:
-                results += "• Class I skeletal pattern\n"
-            elif measurements['ANB'] > 4:
-                results += "• Class II skeletal pattern\n"
-            else:
-                results += "• Class III skeletal pattern\n"
-                
-            # Upper incisor inclination
-            if 18 <= measurements['UI_NA'] <= 26:
-                results += "• Normal upper incisor inclination\n"
-            elif measurements['UI_NA'] > 26:
-                results += "• Proclined upper incisors\n"
-            else:
-                results += "• Retroclined upper incisors\n"
-                
-            # Lower incisor inclination
-            if 21 <= measurements['LI_NB'] <= 29:
-                results += "• Normal lower incisor inclination\n"
-            elif measurements['LI_NB'] > 29:
-                results += "• Proclined lower incisors\n"
-            else:
-                results += "• Retroclined lower incisors\n"
+            for line in describe_interpretation(self.measurement_graph.value('interpretation')):
+                results += f"• {line}\n"
                 
             self.results_text.delete(1.0, tk.END)
             self.results_text.insert(tk.END, results)
@@ -437,6 +668,10 @@ class SteinerAnalysisApp:
         container = ttk.Frame(self.ml_frame)
         container.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
+        # Loading state of the background ML subsystem
+        self.ml_state_label = ttk.Label(container, text="ML model: loading...", foreground='gray')
+        self.ml_state_label.pack(anchor='w', padx=5)
+        
         # Current measurements frame
         current_frame = ttk.LabelFrame(container, text="Current Measurements")
         current_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -467,14 +702,43 @@ class SteinerAnalysisApp:
         btn_frame = ttk.Frame(container)
         btn_frame.pack(fill=tk.X, padx=5, pady=5)
         
-        ttk.Button(btn_frame, text="Add to Training Data", 
-                   command=self.add_training_data).pack(side=tk.LEFT, padx=5)
-        ttk.Button(btn_frame, text="Retrain Model", 
-                   command=self.retrain_model).pack(side=tk.LEFT, padx=5)
+        # Disabled until the ML module has loaded
+        self.ml_buttons = [
+            ttk.Button(btn_frame, text="Add to Training Data", command=self.add_training_data),
+            ttk.Button(btn_frame, text="Retrain Model", command=self.retrain_model),
+            ttk.Button(btn_frame, text="Select Model (CV)", command=self.select_model),
+            ttk.Button(btn_frame, text="Import Tracings...", command=self.import_tracings)
+        ]
+        for button in self.ml_buttons:
+            button.pack(side=tk.LEFT, padx=5)
+            button.state(['disabled'])
+        # Only retraining can be cancelled, so this is enabled just while a retrain runs
+        self.cancel_button = ttk.Button(btn_frame, text="Cancel Training", command=self.cancel_training)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+        self.cancel_button.state(['disabled'])
+        
+        # Incremental update policy
+        self.incremental_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(btn_frame, text="Incremental update",
+                        variable=self.incremental_var).pack(side=tk.LEFT, padx=5)
+        ttk.Label(btn_frame, text="Full refit every").pack(side=tk.LEFT, padx=(10, 2))
+        self.refit_interval_var = tk.IntVar(value=10)
+        ttk.Spinbox(btn_frame, from_=1, to=1000, width=5,
+                    textvariable=self.refit_interval_var).pack(side=tk.LEFT)
+        ttk.Label(btn_frame, text="updates").pack(side=tk.LEFT, padx=2)
+        
+        # Training progress
+        self.training_progress = ttk.Progressbar(container, maximum=1.0)
+        self.training_progress.pack(fill=tk.X, padx=5, pady=(5, 0))
         
         # Status
         self.ml_status = tk.Text(container, height=5, width=50)
         self.ml_status.pack(fill=tk.X, padx=5, pady=5)
+        
+        # Background training state
+        self.training_thread = None
+        self.training_cancel = threading.Event()
+        self.training_events = queue.Queue()
 
     def add_training_data(self):
         """Add current measurements and corrections to training data"""
@@ -495,14 +759,204 @@ class SteinerAnalysisApp:
             messagebox.showerror("Error", "Please enter valid numerical values for all measurements")
 
     def retrain_model(self):
-        """Retrain the ML model with accumulated data"""
-        success, message = self.ml_module.retrain_model()
+        """Retrain the ML model with accumulated data in a background thread"""
+        if self.training_thread is not None and self.training_thread.is_alive():
+            messagebox.showinfo("Info", "Training is already running")
+            return
+        try:
+            self.ml_module.full_refit_interval = max(1, self.refit_interval_var.get())
+        except tk.TclError:
+            pass
+        
+        self.training_cancel.clear()
+        self.training_thread = threading.Thread(
+            target=self.run_training, args=(self.incremental_var.get(),), daemon=True)
+        self.training_thread.start()
+        self.set_ml_buttons_enabled(False)
+        self.cancel_button.state(['!disabled'])
+        self.ml_status.insert(tk.END, "Training started\n")
+        self.root.after(100, self.poll_training)
+
+    def select_model(self):
+        """Cross-validate candidate models in a background thread and promote the best if it is better"""
+        if self.training_thread is not None and self.training_thread.is_alive():
+            messagebox.showinfo("Info", "Training is already running")
+            return
+        
+        self.training_thread = threading.Thread(target=self.run_model_selection, daemon=True)
+        self.training_thread.start()
+        self.set_ml_buttons_enabled(False)
+        self.ml_status.insert(tk.END, "Model selection started, this can take several minutes\n")
+        self.root.after(100, self.poll_training)
+
+    def import_tracings(self):
+        """Stream legacy tracing exports into the training data in a background thread"""
+        if self.training_thread is not None and self.training_thread.is_alive():
+            messagebox.showinfo("Info", "Training is already running")
+            return
+        paths = filedialog.askopenfilenames(
+            title="Select tracing exports",
+            filetypes=[("Tracing exports", "*.csv *.json *.jsonl *.ndjson"), ("All files", "*.*")])
+        if not paths:
+            return
+        
+        # Rejected records are reported next to the first export
+        rejected_path = os.path.splitext(paths[0])[0] + "_rejected.csv"
+        self.training_thread = threading.Thread(target=self.run_import, args=(list(paths), rejected_path),
+                                                daemon=True)
+        self.training_thread.start()
+        self.set_ml_buttons_enabled(False)
+        self.ml_status.insert(tk.END, f"Importing {len(paths)} exports\n")
+        self.root.after(100, self.poll_training)
+
+    def run_import(self, paths, rejected_path):
+        """Worker thread body: stream the exports into the training store, listing rejected records in `rejected_path`"""
+        from training_import import format_summary, import_exports
+        
+        def progress(fraction, message):
+            self.training_events.put(('progress', fraction, message))
+        
+        try:
+            summary = import_exports(paths, self.ml_module.store, rejected_path=rejected_path, progress=progress)
+            self.training_events.put(('log', format_summary(summary)))
+            message = f"Imported {summary['imported']} training examples, retrain the model to use them"
+            if summary['rejected']:
+                message += f"\n{summary['rejected']} rejected records are listed in {rejected_path}"
+            success = summary['imported'] > 0
+        except Exception as e:
+            success, message = False, f"Import failed: {str(e)}"
+        self.training_events.put(('done', success, message))
+
+    def run_model_selection(self):
+        """Worker thread body: cross-validate the candidate grid and log the comparison report"""
+        from model_selection import format_report
+        
+        self.training_events.put(('progress', 0.0, "Cross-validating candidate models..."))
+        try:
+            success, message, report = self.ml_module.select_model()
+            if report is not None:
+                self.training_events.put(('log', format_report(report)))
+        except Exception as e:
+            success, message = False, f"Model selection failed: {str(e)}"
+        self.training_events.put(('done', success, message))
+
+    def run_training(self, incremental):
+        """Worker thread body: never touches Tk, only posts events for poll_training"""
+        def progress(fraction, message):
+            self.training_events.put(('progress', fraction, message))
+        
+        try:
+            success, message = self.ml_module.retrain_model(
+                incremental=incremental, progress=progress, cancel_event=self.training_cancel)
+        except Exception as e:
+            success, message = False, f"Training failed: {str(e)}"
+        self.training_events.put(('done', success, message))
+
+    def poll_training(self):
+        """Apply worker events on the Tk thread, showing only the latest progress line"""
+        latest = None
+        done = None
+        while True:
+            try:
+                event = self.training_events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == 'progress':
+                latest = event
+            elif event[0] == 'log':
+                self.ml_status.insert(tk.END, f"{event[1]}\n")
+            else:
+                done = event
+        
+        if latest is not None:
+            _, fraction, message = latest
+            self.training_progress['value'] = fraction
+            if self.ml_status.tag_ranges("progress"):
+                self.ml_status.delete("progress.first", "progress.last")
+            self.ml_status.insert(tk.END, f"{message}\n", "progress")
+            self.ml_status.see(tk.END)
+        
+        if done is None:
+            self.root.after(100, self.poll_training)
+            return
+        
+        _, success, message = done
+        self.set_ml_buttons_enabled(True)
+        self.cancel_button.state(['disabled'])
+        if self.ml_status.tag_ranges("progress"):
+            self.ml_status.delete("progress.first", "progress.last")
+        self.training_progress['value'] = 1.0 if success else 0.0
+        self.ml_status.insert(tk.END, f"{message}\n")
         if success:
             messagebox.showinfo("Success", message)
         else:
             messagebox.showwarning("Warning", message)
 
+    def cancel_training(self):
+        if self.training_thread is not None and self.training_thread.is_alive():
+            self.training_cancel.set()
+            self.ml_status.insert(tk.END, "Cancelling training...\n")
+
+    def create_diagnostics_tab(self):
+        """Create the tab for switching instrumentation on and viewing its summary"""
+        container = ttk.Frame(self.diagnostics_frame)
+        container.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        
+        btn_frame = ttk.Frame(container)
+        btn_frame.pack(fill=tk.X, padx=5, pady=5)
+        
+        # Timing is off unless switched on here or with CEPH_PROFILE=1
+        self.profiling_var = tk.BooleanVar(value=instrumentation.is_enabled())
+        ttk.Checkbutton(btn_frame, text="Record timings", variable=self.profiling_var,
+                        command=self.toggle_profiling).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Export Trace...", command=self.export_trace).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Reset", command=self.reset_diagnostics).pack(side=tk.LEFT, padx=5)
+        
+        # Rolling summary, times in milliseconds
+        self.diagnostics_text = tk.Text(container, height=30, wrap=tk.NONE, font=('Courier', 9))
+        self.diagnostics_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        
+        self.refresh_diagnostics()
+
+    def toggle_profiling(self):
+        instrumentation.set_enabled(self.profiling_var.get())
+
+    def refresh_diagnostics(self):
+        """Redraw the summary once a second while timings are being recorded"""
+        if instrumentation.is_enabled():
+            self.diagnostics_text.delete(1.0, tk.END)
+            self.diagnostics_text.insert(tk.END, instrumentation.format_summary())
+        elif not self.diagnostics_text.get(1.0, tk.END).strip():
+            self.diagnostics_text.insert(tk.END, "Timings are not being recorded")
+        self.root.after(1000, self.refresh_diagnostics)
+
+    def reset_diagnostics(self):
+        instrumentation.reset()
+        self.diagnostics_text.delete(1.0, tk.END)
+        self.diagnostics_text.insert(tk.END, instrumentation.format_summary())
+
+    def export_trace(self):
+        """Save the recorded spans for chrome://tracing or Perfetto"""
+        file_path = filedialog.asksaveasfilename(defaultextension=".json",
+                                                 filetypes=[("Trace event JSON", "*.json")])
+        if file_path:
+            events = instrumentation.export_chrome_trace(file_path)
+            messagebox.showinfo("Success", f"Exported {events} trace events to {file_path}")
+
 def main():
+    # --serve starts the local analysis service and --import imports tracing exports into the
+    # training data; any other arguments switch to the headless batch mode
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        from analysis_service import main as service_main
+        sys.exit(service_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == '--import':
+        from training_import import main as import_main
+        sys.exit(import_main(sys.argv[2:]))
+    if len(sys.argv) > 1:
+        from batch_analysis import main as batch_main
+        args = sys.argv[2:] if sys.argv[1] == '--batch' else sys.argv[1:]
+        sys.exit(batch_main(args))
+    
     root = tk.Tk()
     app = SteinerAnalysisApp(root)
     root.mainloop()
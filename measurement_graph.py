@@ -0,0 +1,141 @@
+from collections import defaultdict
+import numpy as np
+from steiner_module import (LANDMARK_INDEX, LANDMARK_NAMES, angle_between_lines, incisor_axes,
+                            interpret_measurements)
+
+# Measurements that need only the landmarks the GUI already collects. The occlusal plane
+# angle is not included because no occlusal landmarks are traced yet.
+STEINER_MEASUREMENTS = ('SNA', 'SNB', 'ANB', 'UI_NA', 'LI_NB', 'UI_LI', 'GoGn_SN', 'Holdaway_ratio')
+
+
+class MeasurementGraph:
+    """Declarative graph of landmarks -> lines/vectors -> angles -> interpretations
+
+    Landmarks are the leaves. Every other node is a function of the nodes it names as
+    dependencies and is computed on demand and memoized. Moving a landmark only discards
+    the memoized values downstream of it, so re-analysis after one edit recomputes just
+    the affected nodes. Node values may carry leading batch dimensions.
+    """
+
+    def __init__(self):
+        self.functions = {}
+        self.dependencies = {}
+        self.dependents = defaultdict(set)
+        self.values = {}
+        for name in LANDMARK_NAMES:
+            self.functions[name] = None
+            self.dependencies[name] = ()
+            self.values[name] = np.full(2, np.nan)
+
+    def add_node(self, name, dependencies, function):
+        """Define `name` as `function(*values of dependencies)`"""
+        if name in self.functions:
+            raise ValueError(f"Node '{name}' is already defined")
+        for dependency in dependencies:
+            if dependency not in self.functions:
+                raise ValueError(f"Unknown dependency '{dependency}' of node '{name}'")
+            self.dependents[dependency].add(name)
+        self.functions[name] = function
+        self.dependencies[name] = tuple(dependencies)
+        return self
+
+    def _invalidate(self, name):
+        stack = list(self.dependents[name])
+        while stack:
+            node = stack.pop()
+            if self.values.pop(node, None) is not None:
+                stack.extend(self.dependents[node])
+
+    def set_landmark(self, name, point):
+        """Move one landmark; `point` is (x, y), None for a missing landmark, or a batch of points"""
+        value = np.full(2, np.nan) if point is None else np.asarray(point, dtype=np.float64)
+        if np.array_equal(self.values[name], value, equal_nan=True):
+            return
+        self.values[name] = value
+        self._invalidate(name)
+
+    def set_points(self, points):
+        """Set every landmark from a (..., 19, 2) array"""
+        points = np.asarray(points, dtype=np.float64)
+        for name, i in LANDMARK_INDEX.items():
+            self.values[name] = points[..., i, :]
+        for name in self.functions:
+            if self.functions[name] is not None:
+                self.values.pop(name, None)
+
+    def set_landmarks(self, landmarks):
+        """Set every landmark from a GUI landmarks dictionary or a LandmarkSet; unchanged landmarks keep their results"""
+        if isinstance(landmarks, dict):
+            for name, pos in landmarks.items():
+                point = None if pos['x'] is None or pos['y'] is None else (pos['x'], pos['y'])
+                self.set_landmark(name, point)
+        else:
+            for name, point in zip(LANDMARK_NAMES, np.asarray(landmarks, dtype=np.float64)):
+                self.set_landmark(name, point)
+
+    def value(self, name):
+        """Return the value of a node, computing it and any missing dependencies"""
+        if name in self.values:
+            return self.values[name]
+        arguments = [self.value(dependency) for dependency in self.dependencies[name]]
+        result = self.functions[name](*arguments)
+        self.values[name] = result
+        return result
+
+    def evaluate(self, names):
+        return {name: self.value(name) for name in names}
+
+
+def _vector(start, end):
+    return end - start
+
+
+def _signed_distance_to_line(point, line_start, line_end):
+    """Perpendicular distance from `point` to the line through `line_start` and `line_end`"""
+    direction = line_end - line_start
+    offset = point - line_start
+    cross = direction[..., 0] * offset[..., 1] - direction[..., 1] * offset[..., 0]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return cross / np.hypot(direction[..., 0], direction[..., 1])
+
+
+def build_steiner_graph():
+    """Build the graph of the Steiner measurements and their interpretation"""
+    graph = MeasurementGraph()
+
+    # Reference lines, each shared by every measurement that uses it
+    graph.add_node('SN', ('Sella (S)', 'Nasion (N)'), _vector)
+    graph.add_node('NA', ('Nasion (N)', 'Subspinale (A Point)'), _vector)
+    graph.add_node('NB', ('Nasion (N)', 'Supramentale (B Point)'), _vector)
+    graph.add_node('GoGn', ('Gonion (Go)', 'Gnathion (Gn)'), _vector)
+    graph.add_node('incisor_axes', ('Incision Superius (IS)', 'Incision Inferius (II)'), incisor_axes)
+    graph.add_node('UI_axis', ('incisor_axes',), lambda axes: axes[0])
+    graph.add_node('LI_axis', ('incisor_axes',), lambda axes: axes[1])
+
+    # Angles
+    graph.add_node('SNA', ('SN', 'NA'), angle_between_lines)
+    graph.add_node('SNB', ('SN', 'NB'), angle_between_lines)
+    graph.add_node('ANB', ('SNA', 'SNB'), lambda sna, snb: sna - snb)
+    graph.add_node('UI_NA', ('UI_axis', 'NA'), angle_between_lines)
+    graph.add_node('LI_NB', ('LI_axis', 'NB'), angle_between_lines)
+    # Interincisal angle is the supplement
+    graph.add_node('UI_LI', ('UI_axis', 'LI_axis'), lambda ui, li: 180 - angle_between_lines(ui, li))
+    graph.add_node('GoGn_SN', ('GoGn', 'SN'), angle_between_lines)
+
+    # Holdaway ratio: lower incisor edge to NB against pogonion to NB
+    graph.add_node('II_NB_distance', ('Incision Inferius (II)', 'Nasion (N)', 'Supramentale (B Point)'),
+                   lambda ii, n, b: np.abs(_signed_distance_to_line(ii, n, b)))
+    graph.add_node('Pog_NB_distance', ('Pogonion (Pg)', 'Nasion (N)', 'Supramentale (B Point)'),
+                   lambda pog, n, b: np.abs(_signed_distance_to_line(pog, n, b)))
+    graph.add_node('Holdaway_ratio', ('II_NB_distance', 'Pog_NB_distance'), _ratio)
+
+    # Interpretation
+    graph.add_node('interpretation', ('ANB', 'UI_NA', 'LI_NB'),
+                   lambda anb, ui_na, li_nb: interpret_measurements(
+                       {'ANB': anb, 'UI_NA': ui_na, 'LI_NB': li_nb}))
+    return graph
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(denominator == 0, np.nan, numerator / np.where(denominator == 0, 1, denominator))
@@ -0,0 +1,201 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+from training_store import file_lock
+
+# Bump when the layout of a saved predictor directory changes
+WEIGHTS_FORMAT_VERSION = 1
+# Layout of the unversioned .npz written by earlier releases, which is only ever read
+LEGACY_WEIGHTS_FORMAT_VERSION = 1
+
+
+class NumpyPredictor:
+    """Forward pass of a fitted StandardScaler + MLPRegressor using only NumPy"""
+
+    ACTIVATIONS = {
+        'relu': lambda x: np.maximum(x, 0, out=x),
+        'tanh': lambda x: np.tanh(x, out=x),
+        'logistic': lambda x: np.divide(1.0, 1.0 + np.exp(-x), out=x),
+        'identity': lambda x: x,
+    }
+
+    def __init__(self, mean, scale, coefs, intercepts, activation='relu'):
+        if activation not in self.ACTIVATIONS:
+            raise ValueError(f"Unsupported activation '{activation}'")
+        self.mean = mean
+        self.scale = scale
+        self.coefs = coefs
+        self.intercepts = intercepts
+        self.activation = activation
+
+    @classmethod
+    def from_sklearn(cls, model, scaler):
+        return cls(np.asarray(scaler.mean_, dtype=np.float64), np.asarray(scaler.scale_, dtype=np.float64),
+                   [np.asarray(c) for c in model.coefs_], [np.asarray(b) for b in model.intercepts_],
+                   model.activation)
+
+    def save(self, directory):
+        """Write every array to its own .npy file in `directory` so it can be memory-mapped"""
+        np.save(os.path.join(directory, 'mean.npy'), self.mean)
+        np.save(os.path.join(directory, 'scale.npy'), self.scale)
+        for i, (coef, intercept) in enumerate(zip(self.coefs, self.intercepts)):
+            np.save(os.path.join(directory, f'coef_{i}.npy'), coef)
+            np.save(os.path.join(directory, f'intercept_{i}.npy'), intercept)
+        with open(os.path.join(directory, 'predictor.json'), 'w', encoding='utf-8') as f:
+            json.dump({'format_version': WEIGHTS_FORMAT_VERSION, 'activation': self.activation,
+                       'n_layers': len(self.coefs)}, f)
+
+    @classmethod
+    def load_mapped(cls, directory):
+        """Load weights written by `save`, memory-mapped read-only so every process shares one copy"""
+        with open(os.path.join(directory, 'predictor.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta['format_version'] != WEIGHTS_FORMAT_VERSION:
+            raise ValueError(f"Unsupported weights format version {meta['format_version']}")
+
+        def mapped(name):
+            return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+        return cls(mapped('mean'), mapped('scale'),
+                   [mapped(f'coef_{i}') for i in range(meta['n_layers'])],
+                   [mapped(f'intercept_{i}') for i in range(meta['n_layers'])],
+                   meta['activation'])
+
+    @classmethod
+    def load_legacy(cls, path):
+        """Load the single .npz of weights written before models were versioned (legacy import only)"""
+        with np.load(path) as data:
+            version = int(data['format_version'])
+            if version != LEGACY_WEIGHTS_FORMAT_VERSION:
+                raise ValueError(f"Unsupported weights format version {version}")
+            n_layers = int(data['n_layers'])
+            return cls(data['mean'], data['scale'],
+                       [data[f'coef_{i}'] for i in range(n_layers)],
+                       [data[f'intercept_{i}'] for i in range(n_layers)],
+                       str(data['activation']))
+
+    def predict(self, features):
+        """Predict measurements for an (N, 38) feature array, returning an (N, 6) array"""
+        x = (np.asarray(features, dtype=np.float64) - self.mean) / self.scale
+        activation = self.ACTIVATIONS[self.activation]
+        last = len(self.coefs) - 1
+        for i, (coef, intercept) in enumerate(zip(self.coefs, self.intercepts)):
+            x = x @ coef
+            x += intercept
+            # The output layer of MLPRegressor is linear
+            if i != last:
+                x = activation(x)
+        return x
+
+
+class ModelRepository:
+    """Numbered, immutable model versions in one directory, with a CURRENT file naming the one in use
+
+    A version is written to a temporary directory and renamed into place, and CURRENT is
+    then replaced in one step, so readers never see a partially written model. Weights are
+    memory-mapped read-only, so all processes using a version share one physical copy, and
+    checking for a new version is a read of the few bytes in CURRENT.
+    """
+
+    def __init__(self, directory='cephalometric_models', keep=3):
+        self.directory = directory
+        self.keep = keep
+        self.current_path = os.path.join(directory, 'CURRENT')
+        self.lock_path = os.path.join(directory, '.lock')
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def version_dir(self, version):
+        return os.path.join(self.directory, f'v{version:06d}')
+
+    def versions(self):
+        return sorted(int(name[1:]) for name in os.listdir(self.directory)
+                      if name.startswith('v') and name[1:].isdigit())
+
+    def current_version(self):
+        """The version CURRENT points to, or None before anything is published"""
+        try:
+            with open(self.current_path, encoding='utf-8') as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def publish(self, predictor, files=None, meta=None):
+        """Write a new version and make it current, returning its number
+
+        `files` maps extra file names to callables that write them given a path, and `meta`
+        is stored as the version's meta.json.
+        """
+        temporary = tempfile.mkdtemp(prefix='.publish_', dir=self.directory)
+        try:
+            predictor.save(temporary)
+            for name, write in (files or {}).items():
+                write(os.path.join(temporary, name))
+            with open(os.path.join(temporary, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta or {}, f)
+
+            # Another process may take the same number first; the rename then fails and the next one is tried
+            while True:
+                version = max(self.versions(), default=0) + 1
+                try:
+                    os.rename(temporary, self.version_dir(version))
+                    break
+                except OSError:
+                    if not os.path.exists(self.version_dir(version)):
+                        raise
+        except BaseException:
+            shutil.rmtree(temporary, ignore_errors=True)
+            raise
+
+        # Never move CURRENT back past a newer version published meanwhile; the check and
+        # the update happen under the repository lock so two publishers cannot interleave
+        with self._lock, file_lock(self.lock_path):
+            if (self.current_version() or 0) < version:
+                fd, pointer = tempfile.mkstemp(prefix='.CURRENT_', dir=self.directory)
+                try:
+                    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                        f.write(str(version))
+                    os.replace(pointer, self.current_path)
+                except BaseException:
+                    if os.path.exists(pointer):
+                        os.remove(pointer)
+                    raise
+        self.prune()
+        return version
+
+    def load(self, version=None):
+        """(version, memory-mapped predictor, meta) of `version` or the current one, None if none is published"""
+        if version is None:
+            version = self.current_version()
+            if version is None:
+                return None
+        directory = self.version_dir(version)
+        predictor = NumpyPredictor.load_mapped(directory)
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        return version, predictor, meta
+
+    def prune(self):
+        """Delete all but the newest `keep` versions
+
+        Each version is first renamed out of the versions namespace, so a version is either
+        listed intact or not at all. Where the OS refuses the rename because a process still
+        maps the version (Windows), it is kept and pruned on a later publish.
+        """
+        current = self.current_version()
+        for version in self.versions()[:-self.keep]:
+            if version == current:
+                continue
+            tombstone = os.path.join(self.directory, f'.pruned_{version:06d}_{os.getpid()}_{threading.get_ident()}')
+            try:
+                os.rename(self.version_dir(version), tombstone)
+            except OSError:
+                continue
+            shutil.rmtree(tombstone, ignore_errors=True)
+
+        # Retry versions whose files were still in use when they were pruned
+        for name in os.listdir(self.directory):
+            if name.startswith('.pruned_'):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
@@ -1,59 +1,272 @@
 import numpy as np
-from sklearn.neural_network import MLPRegressor
-from sklearn.preprocessing import StandardScaler
-import joblib
+import copy
+import json
 import os
+import threading
+import time
+from collections import OrderedDict
+import instrumentation
+from landmark_set import LandmarkSet, landmark_features, stack_landmark_sets
+from ml_inference import ModelRepository, NumpyPredictor
+from steiner_module import MEASUREMENT_NAMES
+from training_store import FEATURE_DIM, TrainingStore
+
+# scikit-learn and joblib are only imported when training or when no exported weights exist,
+# so prediction-only processes never load them
+
+class TrainingCancelled(Exception):
+    """Raised inside a training run when its cancel event is set"""
+
 
 class CephalometricML:
-    def __init__(self):
+    def __init__(self, store_dir='training_data', full_refit_interval=10, replay_size=256,
+                 incremental_epochs=50, cache_size=4096, cache_resolution=0.01,
+                 model_dir='cephalometric_models', reload_interval=1.0):
+        # Models are published as numbered versions; every process maps the current one and
+        # switches when another process publishes a newer one
+        self.repository = ModelRepository(model_dir)
+        self.reload_interval = reload_interval
+        self._last_reload_check = time.monotonic()
+        
+        # Files written before models were versioned, imported once as the first version
         self.model_path = 'cephalometric_model.joblib'
         self.scaler_path = 'cephalometric_scaler.joblib'
+        self.weights_path = 'cephalometric_model.npz'
+        self.state_path = 'cephalometric_state.json'
+        
+        # Incremental update policy: every `full_refit_interval`-th retrain is a full refit,
+        # the others train on the new examples plus up to `replay_size` older ones
+        self.full_refit_interval = full_refit_interval
+        self.replay_size = replay_size
+        self.incremental_epochs = incremental_epochs
+        
+        # Guards the model/scaler/predictor triple so a finished training run can swap them at once
+        self._lock = threading.Lock()
+        
+        # Bounded LRU cache of predictions keyed on quantized features and the model version,
+        # which is the published version number (0 while no model is published)
+        self.model_version = 0
+        self.cache_size = cache_size
+        self.cache_resolution = cache_resolution
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        
+        # The sklearn model and scaler are loaded on first use; predictions use the NumPy predictor
+        self._model = None
+        self._scaler = None
+        self.predictor = None
         
-        # Initialize or load the model and scaler
+        # How many stored examples the model has seen, and updates since the last full refit
+        self.trained_count = 0
+        self.updates_since_refit = 0
+        with instrumentation.span('ml.load_model'):
+            if self.repository.current_version() is None:
+                self._import_legacy_model()
+            self._load_current_version()
+        
+        # Corrections are written through to disk so they survive restarts
+        self.store = TrainingStore(store_dir)
+    
+    @property
+    def training_data(self):
+        """Memory-mapped feature rows of all stored training examples"""
+        return self.store.features()
+    
+    @property
+    def training_labels(self):
+        """Memory-mapped label rows of all stored training examples"""
+        return self.store.labels()
+    
+    def _import_legacy_model(self):
+        """Publish unversioned model files from earlier releases as the first version"""
+        model = scaler = predictor = None
         if os.path.exists(self.model_path):
-            self.model = joblib.load(self.model_path)
-            self.scaler = joblib.load(self.scaler_path)
+            import joblib
+            model = joblib.load(self.model_path)
+            scaler = joblib.load(self.scaler_path)
+        if os.path.exists(self.weights_path):
+            predictor = NumpyPredictor.load_legacy(self.weights_path)
+        elif hasattr(model, 'coefs_') and hasattr(scaler, 'mean_'):
+            predictor = NumpyPredictor.from_sklearn(model, scaler)
+        if predictor is None:
+            return
+        
+        state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                state = json.load(f)
+        self._publish(model, scaler, predictor, state)
+    
+    def _load_current_version(self):
+        """Map the current published version; returns False if there is none or it was just pruned"""
+        try:
+            loaded = self.repository.load()
+        except (OSError, ValueError, KeyError):
+            return False
+        if loaded is None:
+            return False
+        version, predictor, state = loaded
+        with self._lock:
+            # The sklearn pair of this version is loaded again on first use
+            self._model, self._scaler, self.predictor = None, None, predictor
+            self.model_version = version
+            self.trained_count = state.get('trained_count', 0)
+            self.updates_since_refit = state.get('updates_since_refit', 0)
+        self.clear_prediction_cache()
+        return True
+    
+    def reload_if_changed(self, force=False):
+        """Switch to a newer version published by another process
+
+        CURRENT is read at most once every `reload_interval` seconds, so this is cheap
+        enough to call before every prediction; `force` reads it regardless.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_reload_check < self.reload_interval:
+            return False
+        self._last_reload_check = now
+        version = self.repository.current_version()
+        if version is None or version == self.model_version:
+            return False
+        with instrumentation.span('ml.reload_model', version=version):
+            return self._load_current_version()
+    
+    def _load_sklearn_model(self):
+        """Load the sklearn model and scaler of the current version, or create untrained ones if none is published"""
+        directory = self.repository.version_dir(self.model_version)
+        if self.model_version:
+            paths = [os.path.join(directory, name) for name in ('model.joblib', 'scaler.joblib')]
+            missing = [os.path.basename(path) for path in paths if not os.path.exists(path)]
+            if missing:
+                # Updating an untrained model here would silently replace the published one
+                raise FileNotFoundError(
+                    f"Model version {self.model_version} is missing {', '.join(missing)}; it can be used "
+                    f"for predictions and replaced by a full retrain, but not updated incrementally")
+            import joblib
+            with instrumentation.span('ml.load_sklearn_model'):
+                self._model = joblib.load(paths[0])
+                self._scaler = joblib.load(paths[1])
         else:
-            self.model = MLPRegressor(
-                hidden_layer_sizes=(100, 50),
-                activation='relu',
-                solver='adam',
-                max_iter=1000
-            )
-            self.scaler = StandardScaler()
-            
-        self.training_data = []
-        self.training_labels = []
+            self._model, self._scaler = self._new_sklearn_model()
+    
+    def _new_sklearn_model(self):
+        """An untrained model and scaler with the default hyperparameters"""
+        from sklearn.neural_network import MLPRegressor
+        from sklearn.preprocessing import StandardScaler
+        model = MLPRegressor(
+            hidden_layer_sizes=(100, 50),
+            activation='relu',
+            solver='adam',
+            max_iter=1000
+        )
+        return model, StandardScaler()
+    
+    def _sklearn_model_for_refit(self):
+        """(model, scaler, error): the current pair, or defaults and the load error if its files are missing
+
+        A full refit only reuses the hyperparameters, so a version published without its
+        sklearn files (such as an imported legacy .npz) can still be replaced by one.
+        """
+        with self._lock:
+            try:
+                return self.model, self.scaler, None
+            except FileNotFoundError as e:
+                return (*self._new_sklearn_model(), e)
+    
+    @property
+    def model(self):
+        if self._model is None:
+            self._load_sklearn_model()
+        return self._model
+    
+    @property
+    def scaler(self):
+        if self._scaler is None:
+            self._load_sklearn_model()
+        return self._scaler
+    
+    def is_trained(self):
+        """Return True once the model has been fitted, either now or in a previous session"""
+        if self.predictor is not None:
+            return True
+        return hasattr(self.model, 'coefs_') and hasattr(self.scaler, 'mean_')
         
     def prepare_input_features(self, landmarks):
-        """Convert landmarks dictionary to feature vector"""
-        features = []
-        for name, pos in landmarks.items():
-            if pos['x'] is not None and pos['y'] is not None:
-                features.extend([pos['x'], pos['y']])
-            else:
-                features.extend([0, 0])  # Use 0 for missing landmarks
-        return np.array(features).reshape(1, -1)
+        """Convert a landmarks dictionary or LandmarkSet to a (1, 38) feature vector in canonical order"""
+        # Missing landmarks are 0
+        return LandmarkSet.coerce(landmarks).features().reshape(1, -1)
     
-    def predict_measurements(self, landmarks):
+    def predict_measurements(self, landmarks, use_sklearn=False):
         """Predict cephalometric measurements using the trained model"""
-        if len(self.training_data) < 5:  # Not enough training data
-            return None
-            
-        features = self.prepare_input_features(landmarks)
-        scaled_features = self.scaler.transform(features)
-        predictions = self.model.predict(scaled_features)
-        
-        return {
-            'SNA': predictions[0][0],
-            'SNB': predictions[0][1],
-            'ANB': predictions[0][2],
-            'UI_NA': predictions[0][3],
-            'LI_NB': predictions[0][4],
-            'UI_LI': predictions[0][5]
-        }
-    
-    def add_training_example(self, landmarks, correct_measurements):
+        self.reload_if_changed()
+        if use_sklearn:
+            with self._lock:
+                model, scaler = self.model, self.scaler
+            if not (hasattr(model, 'coefs_') and hasattr(scaler, 'mean_')):  # Model has never been fitted
+                return None
+            with instrumentation.span('ml.predict_sklearn'):
+                predictions = model.predict(scaler.transform(self.prepare_input_features(landmarks)))
+        else:
+            predictions = self.predict_measurements_batch([landmarks])
+            if predictions is None:
+                return None
+        
+        return {name: predictions[0][i] for i, name in enumerate(MEASUREMENT_NAMES)}
+    
+    def predict_measurements_batch(self, cases):
+        """Predict measurements for an (N, 38) feature array or a list of landmark dictionaries or sets
+
+        Returns an (N, 6) array in MEASUREMENT_NAMES order, or None if no model is trained.
+        Rows already predicted by the current model version are served from the cache.
+        """
+        self.reload_if_changed()
+        if isinstance(cases, np.ndarray):
+            features = np.asarray(cases, dtype=np.float64).reshape(len(cases), FEATURE_DIM)
+        elif cases:
+            features = landmark_features(stack_landmark_sets(cases))
+        else:
+            features = np.empty((0, FEATURE_DIM))
+        
+        with self._lock:
+            predictor, model, scaler = self.predictor, self._model, self._scaler
+            version = self.model_version
+        if predictor is None:
+            if model is None or not (hasattr(model, 'coefs_') and hasattr(scaler, 'mean_')):
+                return None
+            predictor = NumpyPredictor.from_sklearn(model, scaler)
+        
+        # Look every row up in the cache by its quantized coordinates
+        keys = np.round(features / self.cache_resolution).astype(np.int64)
+        keys = [(version, row.tobytes()) for row in keys]
+        predictions = np.empty((len(features), len(MEASUREMENT_NAMES)))
+        misses = []
+        with self._cache_lock:
+            for i, key in enumerate(keys):
+                cached = self._cache.get(key)
+                if cached is None:
+                    misses.append(i)
+                else:
+                    self._cache.move_to_end(key)
+                    predictions[i] = cached
+        instrumentation.count('prediction_cache.hit', len(keys) - len(misses))
+        instrumentation.count('prediction_cache.miss', len(misses))
+        
+        # One vectorized forward pass over all rows that were not cached
+        if misses:
+            with instrumentation.span('ml.predict', rows=len(misses)):
+                predictions[misses] = predictor.predict(features[misses])
+            with self._cache_lock:
+                for i in misses:
+                    self._cache[keys[i]] = predictions[i].copy()
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return predictions
+    
+    def clear_prediction_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+    
+    def add_training_example(self, landmarks, correct_measurements, metadata=None):
         """Add a new training example with corrected measurements"""
         features = self.prepare_input_features(landmarks)
         labels = np.array([
@@ -65,26 +278,167 @@ class CephalometricML:
             correct_measurements['UI_LI']
         ]).reshape(1, -1)
         
-        self.training_data.append(features[0])
-        self.training_labels.append(labels[0])
+        self.store.append(features, labels, metadata)
     
-    def retrain_model(self):
-        """Retrain the model with accumulated training data"""
-        if len(self.training_data) < 5:
+    def retrain_model(self, incremental=True, progress=None, cancel_event=None):
+        """Retrain the model, incrementally on new examples when the refit policy allows it
+
+        Training runs on copies of the model and scaler, which replace the current pair in
+        one step when it finishes, so predictions keep using the previous model meanwhile.
+        `progress(fraction, message)` is called after every epoch, and setting
+        `cancel_event` stops the run and keeps the previous model.
+        """
+        if len(self.store) < 5:
             return False, "Need at least 5 training examples"
+        
+        # Train on top of the newest version, which another process may have published
+        self.reload_if_changed(force=True)
+        model, scaler, missing = self._sklearn_model_for_refit()
+        full_refit = (not incremental or not self.is_trained()
+                      or self.updates_since_refit + 1 >= self.full_refit_interval
+                      or self.trained_count > len(self.store))
+        if missing is not None and not full_refit:
+            raise missing
+        if not full_refit and self.trained_count == len(self.store):
+            return False, "No new training examples since the last update"
+        
+        try:
+            if full_refit:
+                with instrumentation.span('ml.retrain_full', examples=len(self.store)):
+                    model, scaler, trained_count, message = self._full_refit(model, scaler, progress, cancel_event)
+                updates_since_refit = 0
+            else:
+                with instrumentation.span('ml.retrain_incremental', examples=len(self.store)):
+                    model, scaler, trained_count, message = self._incremental_update(
+                        model, scaler, progress, cancel_event)
+                updates_since_refit = self.updates_since_refit + 1
+        except TrainingCancelled:
+            return False, "Training cancelled, the previous model is still in use"
+        
+        # Publish the new version, then swap it in atomically
+        if progress:
+            progress(1.0, "Saving model")
+        predictor = NumpyPredictor.from_sklearn(model, scaler)
+        version = self._publish(model, scaler, predictor, {'trained_count': trained_count,
+                                                           'updates_since_refit': updates_since_refit})
+        with self._lock:
+            self._model, self._scaler, self.predictor = model, scaler, predictor
+            self.model_version = version
+            self.trained_count = trained_count
+            self.updates_since_refit = updates_since_refit
+        
+        # Cached predictions belong to the previous model version
+        self.clear_prediction_cache()
+        return True, message
+    
+    def select_model(self, grid=None, folds=5, holdout_fraction=0.2, jobs=-1, seed=0, promote=True):
+        """Cross-validate a grid of models and promote the best one if it beats the current model
+
+        Returns (promoted, message, report); the report is None when there are too few
+        examples. See model_selection.select_model for the report layout.
+        """
+        from model_selection import select_model
+        
+        needed = max(2 * folds, 10)
+        if len(self.store) < needed:
+            return False, f"Need at least {needed} training examples", None
+        
+        self.reload_if_changed(force=True)
+        model, _, _ = self._sklearn_model_for_refit()
+        with instrumentation.span('ml.select_model', examples=len(self.store)):
+            pipeline, report = select_model(
+                self.store.features(), self.store.labels(), model, self.is_trained(),
+                grid, folds, holdout_fraction, jobs, seed)
+        
+        if pipeline is None:
+            return False, "Current model kept: its configuration is at least as accurate on held-out data", report
+        if not promote:
+            return False, "Best candidate beats the current model (not promoted)", report
+        
+        # Publish the selected model and swap it in atomically; later full refits keep its hyperparameters
+        scaler, model = pipeline.named_steps['scaler'], pipeline.named_steps['model']
+        predictor = NumpyPredictor.from_sklearn(model, scaler)
+        version = self._publish(model, scaler, predictor, {'trained_count': report['examples'],
+                                                           'updates_since_refit': 0})
+        with self._lock:
+            self._model, self._scaler, self.predictor = model, scaler, predictor
+            self.model_version = version
+            self.trained_count = report['examples']
+            self.updates_since_refit = 0
+        self.clear_prediction_cache()
+        error = report['holdout_mae']['candidate']['overall']
+        return True, f"Promoted the selected model (held-out error {error:.3f}°)", report
+    
+    def _train_epochs(self, model, X, y, epochs, progress, cancel_event, stop_early):
+        """Run `epochs` passes of partial_fit, reporting progress and honouring cancellation"""
+        best_loss = np.inf
+        no_improvement = 0
+        for epoch in range(epochs):
+            if cancel_event is not None and cancel_event.is_set():
+                raise TrainingCancelled()
+            model.partial_fit(X, y)
+            if progress:
+                progress((epoch + 1) / epochs, f"Epoch {epoch + 1}/{epochs}, loss {model.loss_:.4f}")
             
-        X = np.array(self.training_data)
-        y = np.array(self.training_labels)
+            # Same stopping rule as MLPRegressor.fit: no improvement by `tol` for `n_iter_no_change` epochs
+            if stop_early:
+                if model.loss_ > best_loss - model.tol:
+                    no_improvement += 1
+                else:
+                    no_improvement = 0
+                best_loss = min(best_loss, model.loss_)
+                if no_improvement > model.n_iter_no_change:
+                    break
+    
+    def _full_refit(self, model, scaler, progress, cancel_event):
+        from sklearn.base import clone
         
-        # Fit scaler and transform training data
-        self.scaler.fit(X)
-        X_scaled = self.scaler.transform(X)
+        # Read the stored examples straight from the memory-mapped files
+        X = self.store.features()
+        y = self.store.labels()
         
-        # Retrain model
-        self.model.fit(X_scaled, y)
+        # Fit a fresh scaler and transform training data
+        scaler = clone(scaler).fit(X)
+        X_scaled = scaler.transform(X)
         
-        # Save model and scaler
-        joblib.dump(self.model, self.model_path)
-        joblib.dump(self.scaler, self.scaler_path)
+        # Retrain a fresh model epoch by epoch so the run can report progress and be cancelled
+        model = clone(model)
+        self._train_epochs(model, X_scaled, y, model.max_iter, progress, cancel_event, stop_early=True)
         
-        return True, f"Model retrained with {len(self.training_data)} examples" 
\ No newline at end of file
+        return model, scaler, len(X), f"Model retrained with {len(X)} examples"
+    
+    def _incremental_update(self, model, scaler, progress, cancel_event):
+        total = len(self.store)
+        X_new = self.store.features(self.trained_count, total)
+        y_new = self.store.labels(self.trained_count, total)
+        
+        # Update the running scaler statistics with the new examples only
+        scaler = copy.deepcopy(scaler).partial_fit(X_new)
+        
+        # Replay a bounded random sample of older examples to limit forgetting
+        replay = min(self.replay_size, self.trained_count)
+        if replay:
+            rng = np.random.default_rng()
+            indices = np.sort(rng.choice(self.trained_count, size=replay, replace=False))
+            X_batch = np.concatenate([X_new, self.store.features(0, self.trained_count)[indices]])
+            y_batch = np.concatenate([y_new, self.store.labels(0, self.trained_count)[indices]])
+        else:
+            X_batch, y_batch = X_new, y_new
+        
+        model = copy.deepcopy(model)
+        X_scaled = scaler.transform(X_batch)
+        self._train_epochs(model, X_scaled, y_batch, self.incremental_epochs, progress, cancel_event,
+                           stop_early=False)
+        
+        return model, scaler, total, (f"Model updated with {len(X_new)} new examples "
+                                      f"({replay} replayed, {total} total)")
+    
+    def _publish(self, model, scaler, predictor, state):
+        """Write a new model version with its training state and make it current; returns its number"""
+        files = {}
+        if model is not None:
+            import joblib
+            files = {'model.joblib': lambda path: joblib.dump(model, path),
+                     'scaler.joblib': lambda path: joblib.dump(scaler, path)}
+        with instrumentation.span('ml.save_model'):
+            return self.repository.publish(predictor, files, state)
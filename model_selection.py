@@ -0,0 +1,191 @@
+"""Cross-validated model selection for the measurement correction model.
+
+A grid of MLP architectures, regularization strengths and learning rates is scored by
+k-fold cross-validation on all CPU cores. The best candidate is then compared on a held-out
+split with the current model configuration retrained on the same training rows, and is
+only promoted if its error there is lower.
+
+Usage:
+    python model_selection.py --folds 5 --jobs -1 --report selection.json
+    python model_selection.py --grid grid.json --dry-run
+"""
+import argparse
+import itertools
+import json
+import sys
+
+import numpy as np
+
+from steiner_module import MEASUREMENT_NAMES
+
+# Keys are MLPRegressor parameters
+DEFAULT_GRID = {
+    'hidden_layer_sizes': [(50,), (100, 50), (200, 100)],
+    'alpha': [1e-4, 1e-3, 1e-2],
+    'learning_rate_init': [1e-3, 3e-3],
+}
+
+
+def _column_mae(y_true, y_pred, column):
+    return float(np.mean(np.abs(y_true[:, column] - y_pred[:, column])))
+
+
+def _scorers():
+    """Overall and per-measurement mean absolute error scorers (negated, as sklearn maximizes)"""
+    from sklearn.metrics import make_scorer
+    scorers = {'mae': 'neg_mean_absolute_error'}
+    for i, name in enumerate(MEASUREMENT_NAMES):
+        scorers[f'mae_{name}'] = make_scorer(_column_mae, greater_is_better=False, column=i)
+    return scorers
+
+
+def measurement_errors(y_true, y_pred):
+    """Mean absolute error of each measurement and over all measurements"""
+    errors = np.abs(np.asarray(y_true) - np.asarray(y_pred))
+    report = {name: float(errors[:, i].mean()) for i, name in enumerate(MEASUREMENT_NAMES)}
+    report['overall'] = float(errors.mean())
+    return report
+
+
+def _as_tuples(grid):
+    """JSON grids give architectures as lists; MLPRegressor expects tuples"""
+    return {key: [tuple(v) if isinstance(v, list) else v for v in values] for key, values in grid.items()}
+
+
+def select_model(X, y, base_model, compare_current=True, grid=None, folds=5, holdout_fraction=0.2,
+                 jobs=-1, seed=0):
+    """Cross-validate `grid` around `base_model` and decide whether the best candidate should be promoted
+
+    `base_model` is the current model; with `compare_current` its configuration is refitted
+    on the same training rows as the candidates, so both are scored on rows neither has seen.
+    Pass False when there is no trained model. Returns a scaler+model pipeline refitted on
+    all examples (None unless the candidate should be promoted) and a report of the
+    cross-validation and held-out errors.
+    """
+    from sklearn.base import clone
+    from sklearn.model_selection import GridSearchCV, KFold
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    grid = _as_tuples(grid or DEFAULT_GRID)
+
+    # Held-out split for the final comparison; never seen by the cross-validation
+    order = np.random.default_rng(seed).permutation(len(X))
+    n_holdout = max(1, int(round(len(X) * holdout_fraction)))
+    holdout, train = order[:n_holdout], order[n_holdout:]
+
+    def make_pipeline():
+        return Pipeline([('scaler', StandardScaler()),
+                         ('model', clone(base_model).set_params(random_state=seed))])
+    pipeline = make_pipeline()
+    search = GridSearchCV(
+        pipeline,
+        {f'model__{key}': values for key, values in grid.items()},
+        scoring=_scorers(),
+        refit='mae',
+        cv=KFold(folds, shuffle=True, random_state=seed),
+        n_jobs=jobs,
+    )
+    search.fit(X[train], y[train])
+
+    # Candidates from best to worst cross-validated error
+    results = search.cv_results_
+    candidates = []
+    for i in np.argsort(results['rank_test_mae']):
+        candidates.append({
+            'params': {key[len('model__'):]: value for key, value in results['params'][i].items()},
+            'cv_mae': float(-results['mean_test_mae'][i]),
+            'cv_mae_std': float(results['std_test_mae'][i]),
+            'cv_mae_per_measurement': {name: float(-results[f'mean_test_mae_{name}'][i])
+                                       for name in MEASUREMENT_NAMES},
+        })
+
+    candidate_errors = measurement_errors(y[holdout], search.best_estimator_.predict(X[holdout]))
+    current_errors = None
+    if compare_current:
+        # The trained current model has usually seen the held-out rows, so retrain its configuration
+        current = make_pipeline().fit(X[train], y[train])
+        current_errors = measurement_errors(y[holdout], current.predict(X[holdout]))
+    promote = current_errors is None or candidate_errors['overall'] < current_errors['overall']
+
+    report = {
+        'examples': len(X),
+        'folds': folds,
+        'holdout_examples': int(n_holdout),
+        'candidates': candidates,
+        'best_params': candidates[0]['params'],
+        'holdout_mae': {'candidate': candidate_errors, 'current': current_errors},
+        'promote': bool(promote),
+    }
+
+    if not promote:
+        return None, report
+    # The promoted model learns from every example, including the held-out ones
+    final = clone(search.best_estimator_).fit(X, y)
+    return final, report
+
+
+def format_report(report):
+    """Plain-text summary of a model selection report"""
+    lines = [f"{len(report['candidates'])} candidates, {report['folds']}-fold CV on "
+             f"{report['examples'] - report['holdout_examples']} examples, "
+             f"{report['holdout_examples']} held out"]
+    lines.append("Best candidates (CV mean absolute error, degrees):")
+    for candidate in report['candidates'][:5]:
+        params = ", ".join(f"{key}={value}" for key, value in candidate['params'].items())
+        lines.append(f"  {candidate['cv_mae']:.3f} ± {candidate['cv_mae_std']:.3f}  {params}")
+
+    lines.append("Held-out error per measurement (candidate / current configuration):")
+    holdout = report['holdout_mae']
+    for name in (*MEASUREMENT_NAMES, 'overall'):
+        current = holdout['current'][name] if holdout['current'] else None
+        current = f"{current:.3f}" if current is not None else "-"
+        lines.append(f"  {name:8s} {holdout['candidate'][name]:8.3f} / {current}")
+    lines.append("The candidate beats the current model" if report['promote']
+                 else "The current model is better on held-out data")
+    return "\n".join(lines)
+
+
+def grid_size(grid):
+    return len(list(itertools.product(*(grid or DEFAULT_GRID).values())))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cross-validated model selection for the correction model")
+    parser.add_argument('--grid', help="JSON file mapping MLPRegressor parameters to lists of values")
+    parser.add_argument('--folds', type=int, default=5, help="Cross-validation folds")
+    parser.add_argument('--holdout', type=float, default=0.2, help="Fraction of examples held out")
+    parser.add_argument('-j', '--jobs', type=int, default=-1, help="Parallel fits (default: all cores)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the splits and model initialization")
+    parser.add_argument('--report', help="Write the full report to this JSON file")
+    parser.add_argument('--dry-run', action='store_true', help="Report only, never promote")
+    parser.add_argument('--store', default='training_data', help="Training data directory")
+    args = parser.parse_args(argv)
+
+    grid = None
+    if args.grid:
+        with open(args.grid, encoding='utf-8') as f:
+            grid = json.load(f)
+
+    from ml_module import CephalometricML
+    ml = CephalometricML(store_dir=args.store)
+    print(f"Cross-validating {grid_size(grid)} candidates x {args.folds} folds on {len(ml.store)} examples",
+          file=sys.stderr)
+    promoted, message, report = ml.select_model(grid, args.folds, args.holdout, args.jobs, args.seed,
+                                                promote=not args.dry_run)
+    if report is None:
+        print(message, file=sys.stderr)
+        return 1
+
+    print(format_report(report))
+    print(message, file=sys.stderr)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+"""Batch export of annotated cephalograms with their Steiner measurement report.
+
+Each page shows the cephalogram with the traced landmarks and the SN, NA and NB lines,
+next to the measurement table and interpretation. Pages are rendered on a process pool
+from a downsampled pyramid level, never the full-resolution image, and the number of
+workers is limited so their combined image memory stays under a cap.
+
+Usage:
+    python report_export.py images/ tracings/ -o reports/ --format png --format pdf
+    python report_export.py images/ tracings/ -o reports/ --combined reports/day.pdf --jobs 4
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from image_module import ImagePyramid, open_cephalogram
+from measurement_graph import STEINER_MEASUREMENTS, build_steiner_graph
+from steiner_module import LANDMARK_INDEX, LANDMARK_NAMES, REQUIRED_LANDMARKS, describe_interpretation
+
+# Normal ranges shown next to each measurement
+NORMS = {
+    'SNA': '82° ± 2',
+    'SNB': '80° ± 2',
+    'ANB': '2° (0-4)',
+    'UI_NA': '22° (18-26)',
+    'LI_NB': '25° (21-29)',
+    'UI_LI': '130°',
+    'GoGn_SN': '32°',
+    'Holdaway_ratio': '1 : 1',
+}
+
+# Reference lines drawn on the image: (from, through, colour)
+REFERENCE_LINES = (
+    ('Sella (S)', 'Nasion (N)', (40, 120, 255)),
+    ('Nasion (N)', 'Subspinale (A Point)', (0, 170, 80)),
+    ('Nasion (N)', 'Supramentale (B Point)', (255, 140, 0)),
+)
+
+PANEL_WIDTH = 560
+
+
+def _font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow before 10.1 only has the fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def _short_label(name):
+    """'Subspinale (A Point)' -> 'A Point'; names without an abbreviation are kept"""
+    if '(' in name:
+        return name[name.index('(') + 1:name.rindex(')')]
+    return name
+
+
+def _decode_reduction(size, max_size):
+    """Factor by which JPEG draft mode can shrink an image of `size` and still cover `max_size`"""
+    factor = 1
+    while factor < 8 and max(size) / (factor * 2) >= max_size:
+        factor *= 2
+    return factor
+
+
+def estimate_case_memory(image_path, max_size=1600):
+    """Rough peak bytes used to render one page, from the image header only"""
+    with Image.open(image_path) as image:
+        width, height = image.size
+        if image.format == 'JPEG':
+            # Decoded straight to grayscale, possibly at a reduced scale
+            factor, source_bytes = _decode_reduction(image.size, max_size), 0
+        else:
+            factor = 1
+            source_bytes = 2 if image.mode.startswith('I;16') else 4 if image.mode in ('I', 'F') else len(image.mode)
+    pixels = (width // factor) * (height // factor)
+    # Decoded source, its 8-bit grayscale copy with pyramid levels (one third more) and the RGB page
+    return pixels * source_bytes + int(pixels * 4 / 3) + (max_size + PANEL_WIDTH) * max_size * 3
+
+
+def render_report(image_path, points, max_size=1600, title=None):
+    """Render one report page; `points` is a (19, 2) array in full-resolution image coordinates"""
+    points = np.asarray(points, dtype=np.float64).reshape(len(LANDMARK_NAMES), 2)
+    # JPEGs are decoded at a reduced size when that still covers the page
+    image, full_size = open_cephalogram(image_path, max_size)
+    scale = min(1.0, max_size / max(full_size))
+    out_size = (max(1, round(full_size[0] * scale)), max(1, round(full_size[1] * scale)))
+    pyramid = ImagePyramid(image, min_size=max(out_size))
+    level_scale = out_size[0] / image.size[0]
+    cephalogram = pyramid.render(level_scale, (0, 0) + image.size, Image.LANCZOS)
+    del pyramid, image
+    cephalogram = cephalogram.convert('RGB')
+
+    page_height = max(cephalogram.size[1], 900)
+    page = Image.new('RGB', (cephalogram.size[0] + PANEL_WIDTH, page_height), 'white')
+    page.paste(cephalogram, (0, 0))
+    draw = ImageDraw.Draw(page)
+    _draw_tracing(draw, points * scale, max(out_size))
+    _draw_panel(draw, points, cephalogram.size[0], title or os.path.basename(image_path))
+    return page
+
+
+def _draw_tracing(draw, points, size):
+    line_width = max(2, size // 600)
+    radius = max(3, size // 300)
+    font = _font(max(12, size // 90))
+
+    for start, through, colour in REFERENCE_LINES:
+        p0, p1 = points[LANDMARK_INDEX[start]], points[LANDMARK_INDEX[through]]
+        if np.isnan(p0).any() or np.isnan(p1).any():
+            continue
+        # Extend the line a little past its second landmark
+        end = p0 + (p1 - p0) * 1.25
+        draw.line([tuple(p0), tuple(end)], fill=colour, width=line_width)
+
+    for name, (x, y) in zip(LANDMARK_NAMES, points):
+        if np.isnan(x) or np.isnan(y):
+            continue
+        draw.ellipse([x - radius, y - radius, x + radius, y + radius], fill=(230, 30, 30), outline='black')
+        draw.text((x + radius + 2, y - radius - 2), _short_label(name), fill=(255, 255, 0), font=font,
+                  stroke_width=1, stroke_fill='black')
+
+
+def _draw_panel(draw, points, left, title):
+    heading = _font(26)
+    font = _font(20)
+    x = left + 30
+    y = 30
+    draw.text((x, y), "Steiner's Cephalometric Analysis", fill='black', font=heading)
+    y += 40
+    draw.text((x, y), title, fill=(80, 80, 80), font=font)
+    y += 28
+    draw.text((x, y), time.strftime('%Y-%m-%d %H:%M'), fill=(80, 80, 80), font=font)
+    y += 50
+
+    missing = [name for name in REQUIRED_LANDMARKS if np.isnan(points[LANDMARK_INDEX[name]]).any()]
+    if missing:
+        draw.text((x, y), "Missing required landmarks:", fill=(200, 0, 0), font=font)
+        for name in missing:
+            y += 28
+            draw.text((x + 20, y), name, fill=(200, 0, 0), font=font)
+        return
+
+    graph = build_steiner_graph()
+    graph.set_points(points)
+    values = graph.evaluate(STEINER_MEASUREMENTS)
+
+    draw.text((x, y), "Measurement", fill='black', font=font)
+    draw.text((x + 230, y), "Value", fill='black', font=font)
+    draw.text((x + 350, y), "Norm", fill='black', font=font)
+    y += 30
+    draw.line([(x, y), (x + PANEL_WIDTH - 60, y)], fill='black', width=1)
+    y += 10
+    for name in STEINER_MEASUREMENTS:
+        value = float(values[name])
+        if np.isnan(value):
+            text = "-"
+        elif name == 'Holdaway_ratio':
+            text = f"{value:.2f}"
+        else:
+            text = f"{value:.1f}°"
+        label = "Holdaway ratio" if name == 'Holdaway_ratio' else name.replace('_', '-')
+        draw.text((x, y), label, fill='black', font=font)
+        draw.text((x + 230, y), text, fill='black', font=font)
+        draw.text((x + 350, y), NORMS[name], fill=(80, 80, 80), font=font)
+        y += 30
+
+    y += 30
+    draw.text((x, y), "Interpretation", fill='black', font=heading)
+    y += 40
+    for line in describe_interpretation(graph.value('interpretation')):
+        draw.text((x, y), f"- {line}", fill='black', font=font)
+        y += 30
+
+
+def export_case(image_path, points, output_dir, formats=('png',), max_size=1600, return_page=False):
+    """Render one case and write it in each format; worker body for export_reports
+
+    Returns the written paths and, with `return_page`, the raw page pixels for a combined PDF.
+    """
+    page = render_report(image_path, points, max_size)
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    outputs = []
+    for fmt in formats:
+        path = os.path.join(output_dir, f"{stem}_steiner.{fmt}")
+        if fmt == 'pdf':
+            page.save(path, 'PDF', resolution=150)
+        else:
+            # Fast compression: encoding at the default level takes longer than rendering
+            page.save(path, compress_level=1)
+        outputs.append(path)
+
+    # Raw pixels are cheaper to pass back than a second encode and decode
+    raw = (page.size, page.tobytes()) if return_page else None
+    return outputs, raw
+
+
+def export_reports(cases, output_dir, formats=('png',), jobs=None, memory_cap=1024 * 1024 * 1024,
+                   max_size=1600, combined_pdf=None, progress=None):
+    """Export report pages for `cases`, a list of (image path, (19, 2) points) pairs
+
+    Returns (written paths, {image path: error message}). Pages are appended to
+    `combined_pdf` in case order as they finish.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    total = len(cases)
+    errors = {}
+
+    # Images whose header cannot be read fail here instead of in a worker
+    estimates = {}
+    for path, _ in cases:
+        try:
+            estimates[path] = estimate_case_memory(path, max_size)
+        except Exception as e:
+            errors[path] = str(e)
+    done = len(errors)
+    if progress and done:
+        progress(done, total)
+    cases = [(path, points) for path, points in cases if path in estimates]
+    if not cases:
+        return [], errors
+
+    # Fewer workers when each one needs a large share of the memory cap
+    jobs = jobs or os.cpu_count() or 1
+    jobs = max(1, min(jobs, memory_cap // max(max(estimates.values()), 1), len(cases)))
+
+    written = []
+    pages = {}
+    next_page = 0
+    appended = False
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = {}
+        next_case = 0
+        while next_case < len(cases) or pending:
+            # Keep only a few cases in flight so finished pages do not pile up
+            while next_case < len(cases) and len(pending) < 2 * jobs:
+                path, points = cases[next_case]
+                future = pool.submit(export_case, path, np.asarray(points, dtype=np.float32), output_dir,
+                                     tuple(formats), max_size, combined_pdf is not None)
+                pending[future] = next_case
+                next_case += 1
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index = pending.pop(future)
+                try:
+                    outputs, raw = future.result()
+                    written.extend(outputs)
+                except Exception as e:
+                    errors[cases[index][0]] = str(e)
+                    raw = None
+                pages[index] = raw
+                done += 1
+                if progress:
+                    progress(done, total)
+
+            # Append finished pages to the combined PDF in case order
+            while combined_pdf is not None and next_page in pages:
+                raw = pages.pop(next_page)
+                next_page += 1
+                if raw is None:
+                    continue
+                Image.frombytes('RGB', *raw).save(combined_pdf, 'PDF', resolution=150, append=appended)
+                appended = True
+
+    if appended:
+        written.append(combined_pdf)
+    return written, errors
+
+
+def main(argv=None):
+    from batch_analysis import pair_tracings
+
+    parser = argparse.ArgumentParser(description="Export annotated Steiner analysis reports")
+    parser.add_argument('images', help="Directory of cephalograms")
+    parser.add_argument('tracings', help="Directory of CSV/JSON landmark files named like the images")
+    parser.add_argument('-o', '--output', default='reports', help="Output directory")
+    parser.add_argument('--format', choices=('png', 'pdf'), action='append',
+                        help="Per-case output format (repeatable, default png)")
+    parser.add_argument('--combined', help="Also write every page into this PDF, in case order")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--memory-cap-mb', type=int, default=1024,
+                        help="Memory budget for all workers' images (default 1024)")
+    parser.add_argument('--max-size', type=int, default=1600, help="Longest side of the rendered image")
+    args = parser.parse_args(argv)
+
+    cases, tracing_errors = pair_tracings(args.images, args.tracings)
+    for path, error in tracing_errors.items():
+        print(f"{path}: {error}", file=sys.stderr)
+    if not cases:
+        print(f"No traced images found in {args.images}", file=sys.stderr)
+        return 1
+
+    def progress(done, total):
+        print(f"{done}/{total} reports exported", file=sys.stderr)
+
+    start = time.perf_counter()
+    written, errors = export_reports(cases, args.output, args.format or ['png'], args.jobs,
+                                     args.memory_cap_mb * 1024 * 1024, args.max_size, args.combined, progress)
+    for path, error in errors.items():
+        print(f"{path}: {error}", file=sys.stderr)
+    print(f"Exported {len(cases) - len(errors)} reports ({len(errors)} failed) to {args.output} "
+          f"in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return 0 if not errors and not tracing_errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+import numpy as np
+
+# Canonical landmark order shared by the GUI, the measurement engine and the ML features
+LANDMARK_NAMES = (
+    'Sella (S)',
+    'Nasion (N)',
+    'Orbitale (Or)',
+    'Porion (Po)',
+    'Subspinale (A Point)',
+    'Supramentale (B Point)',
+    'Pogonion (Pg)',
+    'Menton (Me)',
+    'Gnathion (Gn)',
+    'Gonion (Go)',
+    'Incision Inferius (II)',
+    'Incision Superius (IS)',
+    'Upper lip',
+    'Lower lip',
+    'Subnasale (Sn)',
+    'Soft tissue Pogonion (Pog\')',
+    'Posterior Nasal Spine (PNS)',
+    'Anterior Nasal Spine (ANS)',
+    'Articulare (Ar)'
+)
+LANDMARK_INDEX = {name: i for i, name in enumerate(LANDMARK_NAMES)}
+
+MEASUREMENT_NAMES = ('SNA', 'SNB', 'ANB', 'UI_NA', 'LI_NB', 'UI_LI')
+
+# Landmarks that must be placed before the Steiner measurements can be computed
+REQUIRED_LANDMARKS = (
+    'Sella (S)', 'Nasion (N)', 'Subspinale (A Point)',
+    'Supramentale (B Point)', 'Incision Inferius (II)',
+    'Incision Superius (IS)'
+)
+
+# Distance from the incisal edge to the estimated incisor root, in image pixels
+INCISOR_ROOT_OFFSET = 30
+
+S = LANDMARK_INDEX['Sella (S)']
+N = LANDMARK_INDEX['Nasion (N)']
+A = LANDMARK_INDEX['Subspinale (A Point)']
+B = LANDMARK_INDEX['Supramentale (B Point)']
+II = LANDMARK_INDEX['Incision Inferius (II)']
+IS = LANDMARK_INDEX['Incision Superius (IS)']
+
+
+def angle_between_lines(v1, v2):
+    """Calculate the acute angles between two batches of lines in degrees"""
+    v1 = np.asarray(v1, dtype=np.float64)
+    v2 = np.asarray(v2, dtype=np.float64)
+
+    # Dot products and magnitudes along the last axis
+    dot_product = v1[..., 0] * v2[..., 0] + v1[..., 1] * v2[..., 1]
+    magnitudes = np.hypot(v1[..., 0], v1[..., 1]) * np.hypot(v2[..., 0], v2[..., 1])
+
+    # Zero-length lines give an angle of 0, as in the per-case calculation
+    degenerate = magnitudes == 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cosine_angle = np.clip(dot_product / np.where(degenerate, 1.0, magnitudes), -1.0, 1.0)
+    angle = np.degrees(np.arccos(cosine_angle))
+    angle = np.where(degenerate, 0.0, angle)
+
+    # Return the acute angle (always between 0 and 90 degrees)
+    return np.minimum(angle, 180 - angle)
+
+
+def incisor_axes(upper_edge, lower_edge):
+    """Return the estimated upper and lower incisor axis vectors from the incisal edges"""
+    upper_edge = np.asarray(upper_edge, dtype=np.float64)
+    lower_edge = np.asarray(lower_edge, dtype=np.float64)
+    ui_root = upper_edge + (0, INCISOR_ROOT_OFFSET)  # Estimated root position
+    li_root = lower_edge - (0, INCISOR_ROOT_OFFSET)
+    return upper_edge - ui_root, lower_edge - li_root
+
+
+def calculate_measurements(points):
+    """Calculate all Steiner measurements for an (N, 19, 2) landmark array in one pass"""
+    points = np.asarray(points, dtype=np.float64)
+
+    # Reference lines shared by several measurements
+    sn_vector = points[..., N, :] - points[..., S, :]
+    na_vector = points[..., A, :] - points[..., N, :]
+    nb_vector = points[..., B, :] - points[..., N, :]
+    ui_vector, li_vector = incisor_axes(points[..., IS, :], points[..., II, :])
+
+    measurements = {
+        'SNA': angle_between_lines(sn_vector, na_vector),
+        'SNB': angle_between_lines(sn_vector, nb_vector),
+        'ANB': None,
+        'UI_NA': angle_between_lines(ui_vector, na_vector),
+        'LI_NB': angle_between_lines(li_vector, nb_vector),
+        # Interincisal angle is the supplement
+        'UI_LI': 180 - angle_between_lines(ui_vector, li_vector)
+    }
+    measurements['ANB'] = measurements['SNA'] - measurements['SNB']
+    return measurements
+
+
+def missing_required_landmarks(points):
+    """Return a boolean (N, 6) mask of required landmarks that are not placed"""
+    points = np.asarray(points, dtype=np.float64)
+    indices = [LANDMARK_INDEX[name] for name in REQUIRED_LANDMARKS]
+    return np.isnan(points[..., indices, :]).any(axis=-1)
+
+
+def interpret_measurements(measurements):
+    """Classify the skeletal pattern and incisor inclinations for a batch of measurements"""
+    anb = np.asarray(measurements['ANB'])
+    ui_na = np.asarray(measurements['UI_NA'])
+    li_nb = np.asarray(measurements['LI_NB'])
+    return {
+        'skeletal_pattern': np.select([(anb >= 0) & (anb <= 4), anb > 4],
+                                      ['Class I', 'Class II'], 'Class III'),
+        'upper_incisor': np.select([(ui_na >= 18) & (ui_na <= 26), ui_na > 26],
+                                   ['Normal', 'Proclined'], 'Retroclined'),
+        'lower_incisor': np.select([(li_nb >= 21) & (li_nb <= 29), li_nb > 29],
+                                   ['Normal', 'Proclined'], 'Retroclined')
+    }
+
+
+def describe_interpretation(interpretation):
+    """Return the report lines for the interpretation of a single case"""
+    lines = [f"{interpretation['skeletal_pattern']} skeletal pattern"]
+    for key, jaw in (('upper_incisor', 'upper'), ('lower_incisor', 'lower')):
+        inclination = str(interpretation[key])
+        if inclination == 'Normal':
+            lines.append(f"Normal {jaw} incisor inclination")
+        else:
+            lines.append(f"{inclination} {jaw} incisors")
+    return lines
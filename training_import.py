@@ -0,0 +1,463 @@
+"""Streaming import of legacy tracing exports into the ML training store.
+
+Exports are read one record at a time by a generator pipeline, validated a chunk at a
+time with NumPy and appended to the TrainingStore chunk by chunk, so memory is bounded by
+the chunk size however long the history is. Supported layouts:
+
+- CSV with one case per row: an x and a y column per landmark ("Sella_x", "S x", "N.y", ...)
+  and one column per measurement (SNA, SNB, ANB, UI_NA, LI_NB, UI_LI).
+- JSON lines, or a JSON array, of case objects {"landmarks": {...}, "measurements": {...}},
+  with landmarks given as {"x", "y"} or [x, y] like batch analysis landmark files.
+
+Landmark and measurement names are matched ignoring case and punctuation against the
+canonical names, their abbreviations and common aliases, and stored in the canonical order
+used by CephalometricML.prepare_input_features. Records that cannot be used are written to
+a rejection report with the reason instead of stopping the import.
+
+Usage:
+    python training_import.py exports/ --store training_data --rejected rejected.csv
+    python training_import.py history.jsonl --aliases aliases.json --dry-run
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import sys
+import time
+from itertools import chain
+from operator import itemgetter
+
+import numpy as np
+
+from steiner_module import LANDMARK_INDEX, LANDMARK_NAMES, MEASUREMENT_NAMES, REQUIRED_LANDMARKS
+
+EXPORT_EXTENSIONS = ('.csv', '.json', '.jsonl', '.ndjson')
+
+# Names used by older exports that are not derived from the canonical names
+LANDMARK_ALIASES = {
+    'A': 'Subspinale (A Point)',
+    'Point A': 'Subspinale (A Point)',
+    'B': 'Supramentale (B Point)',
+    'Point B': 'Supramentale (B Point)',
+    'Pog': 'Pogonion (Pg)',
+    'U1': 'Incision Superius (IS)',
+    'U1 tip': 'Incision Superius (IS)',
+    'L1': 'Incision Inferius (II)',
+    'L1 tip': 'Incision Inferius (II)',
+    'UL': 'Upper lip',
+    'LL': 'Lower lip',
+    'Soft tissue Pog': 'Soft tissue Pogonion (Pog\')',
+}
+MEASUREMENT_ALIASES = {
+    'U1-NA': 'UI_NA',
+    'L1-NB': 'LI_NB',
+    'U1-L1': 'UI_LI',
+    'Interincisal': 'UI_LI',
+}
+
+# Columns copied into the training metadata as the case identifier
+CASE_COLUMNS = ('id', 'case', 'caseid', 'patient', 'patientid', 'file')
+
+# Coordinate column: landmark name, a separator and x or y
+COORDINATE_COLUMN = re.compile(r'^(.+?)[\s_.\-]*\(?([xXyY])\)?$')
+
+# Measurements are angles in degrees
+MAX_ABS_MEASUREMENT = 360.0
+
+_REQUIRED_INDICES = np.array([LANDMARK_INDEX[name] for name in REQUIRED_LANDMARKS])
+
+
+def _key(name):
+    """Lookup key of a name: lower case, ' as 'prime', other punctuation and spaces dropped"""
+    return re.sub(r'[^a-z0-9]', '', str(name).lower().replace("'", 'prime'))
+
+
+def build_aliases(extra=None):
+    """Lookup tables from name keys to landmark and measurement indices
+
+    Every canonical landmark is known by its full name, the name before the parentheses
+    and the abbreviation inside them. `extra` maps further names to canonical landmark
+    or measurement names and overrides the built-in aliases.
+    """
+    landmarks = {}
+    for name, index in LANDMARK_INDEX.items():
+        landmarks[_key(name)] = index
+        match = re.match(r'^(.*?)\s*\((.*)\)$', name)
+        if match:
+            landmarks[_key(match.group(1))] = index
+            landmarks[_key(match.group(2))] = index
+    measurements = {_key(name): i for i, name in enumerate(MEASUREMENT_NAMES)}
+
+    for alias, canonical in {**LANDMARK_ALIASES, **MEASUREMENT_ALIASES, **(extra or {})}.items():
+        if canonical in LANDMARK_INDEX:
+            landmarks[_key(alias)] = LANDMARK_INDEX[canonical]
+        elif canonical in MEASUREMENT_NAMES:
+            measurements[_key(alias)] = MEASUREMENT_NAMES.index(canonical)
+        else:
+            raise ValueError(f"Alias '{alias}' maps to unknown name '{canonical}'")
+    return landmarks, measurements
+
+
+def find_exports(paths):
+    """Expand directories to the export files they contain"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if name.lower().endswith(EXPORT_EXTENSIONS)))
+        else:
+            files.append(path)
+    return files
+
+
+class _Record:
+    """One case as read from an export, before validation
+
+    `coordinates` holds x0, y0, x1, y1, ... in canonical landmark order and `values` the
+    measurements in MEASUREMENT_NAMES order; both may still be strings. `reason` is set
+    when the record was already rejected while reading.
+    """
+
+    __slots__ = ('source', 'number', 'case', 'coordinates', 'values', 'reason')
+
+    def __init__(self, source, number, case, coordinates=None, values=None, reason=None):
+        self.source = source
+        self.number = number
+        self.case = case
+        self.coordinates = coordinates
+        self.values = values
+        self.reason = reason
+
+
+def read_csv_records(f, source, aliases):
+    """Yield the rows of a CSV export with one case per row"""
+    landmark_keys, measurement_keys = aliases
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        return
+
+    # Map the header to canonical positions once; every row is then read by index
+    coordinate_columns = [None] * (2 * len(LANDMARK_NAMES))
+    measurement_columns = [None] * len(MEASUREMENT_NAMES)
+    case_column = None
+    for i, column in enumerate(header):
+        key = _key(column)
+        match = COORDINATE_COLUMN.match(column.strip())
+        if key in measurement_keys:
+            measurement_columns[measurement_keys[key]] = i
+        elif match and _key(match.group(1)) in landmark_keys:
+            index = landmark_keys[_key(match.group(1))]
+            coordinate_columns[2 * index + (match.group(2).lower() == 'y')] = i
+        elif key in CASE_COLUMNS and case_column is None:
+            case_column = i
+
+    missing = [name for i, name in enumerate(MEASUREMENT_NAMES) if measurement_columns[i] is None]
+    missing += [name for name in REQUIRED_LANDMARKS
+                if None in coordinate_columns[2 * LANDMARK_INDEX[name]:2 * LANDMARK_INDEX[name] + 2]]
+    if missing:
+        yield _Record(source, 0, None, reason=f"No columns for {', '.join(missing)}")
+        return
+
+    # Landmarks without columns read an empty field appended to every row
+    width = len(header)
+    n_coordinates = len(coordinate_columns)
+    fields = itemgetter(*(width if i is None else i for i in coordinate_columns + measurement_columns))
+    for number, row in enumerate(reader, 1):
+        if len(row) != width:
+            if any(row):
+                yield _Record(source, number, None, reason=f"Row has {len(row)} fields, the header has {width}")
+            continue
+        case = row[case_column] if case_column is not None else None
+        row.append('')
+        values = fields(row)
+        yield _Record(source, number, case, values[:n_coordinates], values[n_coordinates:])
+
+
+def iter_json_values(f, chunk_size=1 << 20):
+    """Yield the elements of a top-level JSON array, or a lone JSON value, reading `chunk_size` characters at a time"""
+    decoder = json.JSONDecoder()
+    skip = re.compile(r'[\s,]*')
+    buffer, position, eof = '', 0, False
+    in_array = None
+    while True:
+        position = skip.match(buffer, position).end()
+        if position == len(buffer):
+            if eof:
+                return
+            buffer, position = f.read(chunk_size), 0
+            eof = not buffer
+            continue
+        if in_array is None:
+            in_array = buffer[position] == '['
+            position += in_array
+            continue
+        if in_array and buffer[position] == ']':
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+            # A number ending exactly at the end of the buffer may continue in the next chunk
+            complete = end < len(buffer) or eof
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+        if not complete:
+            # The value continues past the buffer: keep the unread text and read more
+            more = f.read(chunk_size)
+            buffer, position, eof = buffer[position:] + more, 0, not more
+            continue
+        position = end
+        yield value
+        if not in_array:
+            return
+
+
+def _json_record(data, source, number, aliases):
+    landmark_keys, measurement_keys = aliases
+    if not isinstance(data, dict):
+        return _Record(source, number, None, reason="Not a JSON object")
+    case = next((data[key] for key in data if _key(key) in CASE_COLUMNS), None)
+    try:
+        landmarks = data['landmarks']
+        measurements = data.get('measurements', data)
+        if isinstance(landmarks, list):
+            # [{"landmark": name, "x": x, "y": y}, ...] like a long CSV export
+            landmarks = {entry['landmark']: entry for entry in landmarks}
+        coordinates = [None] * (2 * len(LANDMARK_NAMES))
+        for name, pos in landmarks.items():
+            index = landmark_keys.get(_key(name))
+            if index is None:
+                return _Record(source, number, case, reason=f"Unknown landmark '{name}'")
+            if isinstance(pos, dict):
+                coordinates[2 * index:2 * index + 2] = pos.get('x'), pos.get('y')
+            else:
+                coordinates[2 * index:2 * index + 2] = pos[0], pos[1]
+        values = [None] * len(MEASUREMENT_NAMES)
+        for name, value in measurements.items():
+            index = measurement_keys.get(_key(name))
+            if index is not None:
+                values[index] = value
+    except (KeyError, IndexError, TypeError, AttributeError) as e:
+        return _Record(source, number, case, reason=f"Malformed record: {e!r}")
+    return _Record(source, number, case, coordinates, values)
+
+
+def read_json_records(f, source, aliases, lines):
+    """Yield the cases of a JSON lines export, or of a JSON array export"""
+    if lines:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                yield _Record(source, number, None, reason=f"Invalid JSON: {e}")
+                continue
+            yield _json_record(data, source, number, aliases)
+        return
+
+    number = 0
+    try:
+        for number, data in enumerate(iter_json_values(f), 1):
+            yield _json_record(data, source, number, aliases)
+    except ValueError as e:
+        yield _Record(source, number + 1, None, reason=f"Invalid JSON, rest of file skipped: {e}")
+
+
+def read_records(paths, aliases, progress=None):
+    """Yield the records of every export in turn; `progress(bytes_read)` is called as files are read"""
+    done = 0
+    for path in paths:
+        source = os.path.basename(path)
+        lower = path.lower()
+        try:
+            with open(path, 'rb') as raw:
+                f = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='' if lower.endswith('.csv') else None)
+                if lower.endswith('.csv'):
+                    records = read_csv_records(f, source, aliases)
+                else:
+                    records = read_json_records(f, source, aliases, lower.endswith(('.jsonl', '.ndjson')))
+                for i, record in enumerate(records):
+                    yield record
+                    if progress and i % 1024 == 0:
+                        progress(done + raw.tell())
+                done += raw.tell()
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            yield _Record(source, 0, None, reason=f"Could not read file: {e}")
+        if progress:
+            progress(done)
+
+
+def chunked(records, size):
+    """Group an iterable into lists of at most `size` items"""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _as_float(rows, width):
+    """(len(rows), width) float64 array of strings or numbers, NaN for None or ''
+
+    Raises ValueError or TypeError if any value is not a number.
+    """
+    try:
+        values = np.fromiter(map(float, chain.from_iterable(rows)), np.float64, len(rows) * width)
+    except (ValueError, TypeError):
+        # Missing values are '' in CSV and None in JSON exports
+        values = np.array([np.nan if v is None or v == '' else float(v) for v in chain.from_iterable(rows)],
+                          dtype=np.float64)
+    return values.reshape(len(rows), width)
+
+
+def validate_chunk(chunk):
+    """Split a chunk of records into (features, labels, metadata) to store and (record, reason) rejections"""
+    rejected = [(record, record.reason) for record in chunk if record.reason is not None]
+    chunk = [record for record in chunk if record.reason is None]
+
+    # Convert the whole chunk at once; fall back to per-record conversion to find unparsable values
+    n_coordinates, n_values = 2 * len(LANDMARK_NAMES), len(MEASUREMENT_NAMES)
+    try:
+        coordinates = _as_float([record.coordinates for record in chunk], n_coordinates)
+        values = _as_float([record.values for record in chunk], n_values)
+    except (ValueError, TypeError):
+        parsed = []
+        for record in chunk:
+            try:
+                parsed.append((record, _as_float([record.coordinates], n_coordinates),
+                               _as_float([record.values], n_values)))
+            except (ValueError, TypeError) as e:
+                rejected.append((record, f"Not a number: {e}"))
+        chunk = [record for record, _, _ in parsed]
+        coordinates = np.concatenate([c for _, c, _ in parsed] or [np.empty((0, n_coordinates))])
+        values = np.concatenate([v for _, _, v in parsed] or [np.empty((0, n_values))])
+    coordinates = coordinates.reshape(len(chunk), len(LANDMARK_NAMES), 2)
+
+    # Vectorized checks; each record is reported with the first check it fails
+    missing = np.isnan(coordinates)
+    checks = [
+        (~np.isfinite(values).all(axis=1), lambda i: "Missing or invalid measurements: " + ", ".join(
+            name for name, ok in zip(MEASUREMENT_NAMES, np.isfinite(values[i])) if not ok)),
+        ((np.abs(np.nan_to_num(values)) > MAX_ABS_MEASUREMENT).any(axis=1),
+         lambda i: f"Measurement out of range (more than {MAX_ABS_MEASUREMENT:g} degrees)"),
+        (np.isinf(coordinates).any(axis=(1, 2)), lambda i: "Infinite coordinate"),
+        ((missing[:, :, 0] != missing[:, :, 1]).any(axis=1), lambda i: "Landmark with only one coordinate: "
+         + ", ".join(LANDMARK_NAMES[j] for j in np.flatnonzero(missing[i, :, 0] != missing[i, :, 1]))),
+        (missing[:, _REQUIRED_INDICES].any(axis=(1, 2)), lambda i: "Missing required landmarks: " + ", ".join(
+            REQUIRED_LANDMARKS[j] for j in np.flatnonzero(missing[i, _REQUIRED_INDICES].any(axis=1)))),
+    ]
+    valid = np.ones(len(chunk), dtype=bool)
+    for failed, reason in checks:
+        for i in np.flatnonzero(failed & valid):
+            rejected.append((chunk[i], reason(i)))
+        valid &= ~failed
+
+    # Same features as prepare_input_features: canonical order, 0 for missing landmarks
+    features = np.nan_to_num(coordinates[valid], nan=0.0).reshape(-1, 2 * len(LANDMARK_NAMES))
+    metadata = [{'source': record.source, 'record': record.number,
+                 **({'case': str(record.case)} if record.case is not None else {})}
+                for record, ok in zip(chunk, valid) if ok]
+    return features, values[valid], metadata, rejected
+
+
+def import_exports(paths, store, chunk_size=10000, aliases=None, rejected_path=None, dry_run=False,
+                   progress=None):
+    """Stream `paths` into `store` and return a summary of what was imported and rejected
+
+    `aliases` maps extra names to canonical landmark or measurement names. Rejected records
+    are written to `rejected_path` as CSV, which is only created if something is rejected.
+    `progress(fraction, message)` is called after every chunk.
+    """
+    aliases = build_aliases(aliases)
+    total_bytes = sum(os.path.getsize(path) for path in paths if os.path.exists(path)) or 1
+    bytes_read = [0]
+
+    def read(position):
+        bytes_read[0] = position
+
+    start = time.perf_counter()
+    summary = {'files': len(paths), 'records': 0, 'imported': 0, 'rejected': 0, 'reasons': {}}
+    report = writer = None
+    try:
+        for chunk in chunked(read_records(paths, aliases, read), chunk_size):
+            features, labels, metadata, rejected = validate_chunk(chunk)
+            if len(features) and not dry_run:
+                store.append(features, labels, metadata)
+
+            summary['records'] += sum(record.number > 0 for record in chunk)
+            summary['imported'] += len(features)
+            summary['rejected'] += len(rejected)
+            for record, reason in rejected:
+                # Count reasons without per-landmark detail so the summary stays short
+                kind = reason.split(':')[0]
+                summary['reasons'][kind] = summary['reasons'].get(kind, 0) + 1
+            if rejected and rejected_path:
+                if report is None:
+                    report = open(rejected_path, 'w', newline='', encoding='utf-8')
+                    writer = csv.writer(report)
+                    writer.writerow(['source', 'record', 'case', 'reason'])
+                writer.writerows((record.source, record.number, record.case or '', reason)
+                                 for record, reason in rejected)
+
+            if progress:
+                progress(min(1.0, bytes_read[0] / total_bytes),
+                         f"{summary['records']} records read, {summary['imported']} imported, "
+                         f"{summary['rejected']} rejected")
+    finally:
+        if report is not None:
+            report.close()
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+def format_summary(summary, dry_run=False):
+    verb = "Would import" if dry_run else "Imported"
+    lines = [f"{verb} {summary['imported']} of {summary['records']} records from {summary['files']} files "
+             f"in {summary['seconds']:.1f}s ({summary['rejected']} rejected)"]
+    for reason, count in sorted(summary['reasons'].items(), key=lambda item: -item[1]):
+        lines.append(f"  {count:8d}  {reason}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import legacy tracing exports into the ML training data")
+    parser.add_argument('paths', nargs='+', help="CSV, JSON or JSON lines exports, or directories of them")
+    parser.add_argument('--store', default='training_data', help="Training data directory")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="Records validated and appended at a time")
+    parser.add_argument('--aliases', help="JSON file mapping export names to canonical landmark or measurement names")
+    parser.add_argument('--rejected', default='rejected_records.csv', help="Report of rejected records")
+    parser.add_argument('--dry-run', action='store_true', help="Validate only, do not append to the store")
+    args = parser.parse_args(argv)
+
+    paths = find_exports(args.paths)
+    if not paths:
+        print("No exports found", file=sys.stderr)
+        return 1
+    aliases = None
+    if args.aliases:
+        with open(args.aliases, encoding='utf-8') as f:
+            aliases = json.load(f)
+
+    from training_store import TrainingStore
+    store = TrainingStore(args.store)
+
+    def progress(fraction, message):
+        print(f"\r{fraction:4.0%}  {message}", end='', file=sys.stderr)
+
+    summary = import_exports(paths, store, args.chunk_size, aliases, args.rejected, args.dry_run, progress)
+    print(file=sys.stderr)
+    print(format_summary(summary, args.dry_run))
+    if summary['rejected']:
+        print(f"Rejected records written to {args.rejected}", file=sys.stderr)
+    return 0 if summary['imported'] or not summary['rejected'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
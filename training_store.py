@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+FEATURE_DIM = 38  # 19 landmarks x (x, y)
+LABEL_DIM = 6     # SNA, SNB, ANB, UI_NA, LI_NB, UI_LI
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on the file at `path`, creating it if needed, across processes"""
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            # LK_LOCK gives up after ten seconds; keep waiting for long appends
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class TrainingStore:
+    """Append-only on-disk store of training examples with fixed-width float32 rows
+
+    Features and labels live in two raw float32 files that are only ever appended to,
+    so they can be memory-mapped read-only at any time. Per-example metadata is kept
+    as JSON lines next to them. Appends hold a thread lock and a lock on the store's
+    lock file, so threads and processes can append to the same store at once.
+    """
+
+    def __init__(self, directory='training_data', feature_dim=FEATURE_DIM, label_dim=LABEL_DIM):
+        self.directory = directory
+        self.feature_dim = feature_dim
+        self.label_dim = label_dim
+        self.features_path = os.path.join(directory, 'features.f32')
+        self.labels_path = os.path.join(directory, 'labels.f32')
+        self.metadata_path = os.path.join(directory, 'metadata.jsonl')
+        self.lock_path = os.path.join(directory, '.lock')
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        
+        # A partial row can only be left by a writer that died mid-append
+        with self._locked():
+            self._truncate_partial_rows(len(self))
+
+    def _rows_in(self, path, dim):
+        try:
+            return os.path.getsize(path) // (dim * 4)
+        except OSError:
+            return 0
+
+    def __len__(self):
+        # A row only counts once both its features and labels are fully written
+        return min(self._rows_in(self.features_path, self.feature_dim),
+                   self._rows_in(self.labels_path, self.label_dim))
+
+    @contextmanager
+    def _locked(self):
+        """Hold the thread lock and an exclusive lock on the store's lock file"""
+        with self._lock, file_lock(self.lock_path):
+            yield
+
+    def _truncate_partial_rows(self, count):
+        """Cut both files back to `count` complete rows; only call while holding the lock"""
+        for path, dim in ((self.features_path, self.feature_dim), (self.labels_path, self.label_dim)):
+            if os.path.exists(path) and os.path.getsize(path) != count * dim * 4:
+                with open(path, 'r+b') as f:
+                    f.truncate(count * dim * 4)
+
+    def append(self, features, labels, metadata=None):
+        """Append one or more examples and return the new number of examples"""
+        features = np.ascontiguousarray(features, dtype=np.float32).reshape(-1, self.feature_dim)
+        labels = np.ascontiguousarray(labels, dtype=np.float32).reshape(-1, self.label_dim)
+        if len(features) != len(labels):
+            raise ValueError("features and labels must have the same number of rows")
+
+        if metadata is None:
+            metadata = [{} for _ in range(len(features))]
+        elif isinstance(metadata, dict):
+            metadata = [metadata]
+
+        with self._locked():
+            count = len(self)
+            try:
+                with open(self.features_path, 'ab') as f:
+                    f.write(features.tobytes())
+                with open(self.labels_path, 'ab') as f:
+                    f.write(labels.tobytes())
+            except BaseException:
+                # Do not leave a partial chunk for the next append to build on
+                self._truncate_partial_rows(count)
+                raise
+
+            with open(self.metadata_path, 'a', encoding='utf-8') as f:
+                timestamp = time.time()
+                for i, meta in enumerate(metadata):
+                    f.write(json.dumps({'index': count + i, 'time': timestamp, **meta}) + '\n')
+
+        return count + len(features)
+
+    def _map(self, path, dim, start, stop):
+        count = len(self)
+        stop = count if stop is None else min(stop, count)
+        start = min(start, stop)
+        if stop == start:
+            return np.empty((0, dim), dtype=np.float32)
+        return np.memmap(path, dtype=np.float32, mode='r',
+                         offset=start * dim * 4, shape=(stop - start, dim))
+
+    def features(self, start=0, stop=None):
+        """Read-only memory-mapped view of feature rows [start, stop)"""
+        return self._map(self.features_path, self.feature_dim, start, stop)
+
+    def labels(self, start=0, stop=None):
+        """Read-only memory-mapped view of label rows [start, stop)"""
+        return self._map(self.labels_path, self.label_dim, start, stop)
+
+    def metadata(self):
+        """Iterate over the metadata records of all examples"""
+        if not os.path.exists(self.metadata_path):
+            return
+        with open(self.metadata_path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
@@ -0,0 +1,129 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import instrumentation
+from image_cache import default_cache
+from image_module import ImagePyramid, find_images
+
+
+class LoadedCase:
+    """A decoded, oriented cephalogram with its display pyramid"""
+
+    def __init__(self, path, image, pyramid):
+        self.path = path
+        self.image = image
+        self.pyramid = pyramid
+        self.nbytes = sum(len(level.getbands()) * level.size[0] * level.size[1]
+                          for level in pyramid.levels)
+
+
+def load_case(path, cache=None):
+    """Open one upright grayscale cephalogram with its pyramid, decoding it only if it is not cached"""
+    with instrumentation.span('image.load', path=os.path.basename(path)):
+        levels = (cache or default_cache()).load(path)
+    return LoadedCase(path, levels[0], ImagePyramid.from_levels(levels))
+
+
+class CaseWorklist:
+    """Ordered list of cases whose neighbours are decoded ahead of time on a thread pool
+
+    Cases up to `prefetch` ahead of (and one behind) the current case are loaded in the
+    background. Loaded cases furthest from the current one are dropped whenever the total
+    size would exceed `memory_budget` bytes; the current case is always kept.
+    """
+
+    def __init__(self, paths, prefetch=3, memory_budget=512 * 1024 * 1024, max_workers=2):
+        self.paths = list(paths)
+        self.prefetch = prefetch
+        self.memory_budget = memory_budget
+        self.index = 0
+        self._futures = {}
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='worklist')
+
+    @classmethod
+    def from_folder(cls, folder, **kwargs):
+        return cls(find_images(folder), **kwargs)
+
+    @classmethod
+    def from_case_list(cls, list_path, **kwargs):
+        """Read a text file listing one image path per line, relative to the list file"""
+        base = os.path.dirname(os.path.abspath(list_path))
+        with open(list_path, encoding='utf-8') as f:
+            paths = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        return cls([p if os.path.isabs(p) else os.path.join(base, p) for p in paths], **kwargs)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _schedule(self, index):
+        if 0 <= index < len(self.paths) and index not in self._futures:
+            self._futures[index] = self._executor.submit(load_case, self.paths[index])
+            self._futures[index].add_done_callback(lambda _: self._enforce_budget())
+
+    def _enforce_budget(self):
+        with self._lock:
+            loaded = {i: f.result().nbytes for i, f in self._futures.items()
+                      if f.done() and f.exception() is None}
+            total = sum(loaded.values())
+            # Drop the loaded cases furthest from the current one first
+            for i in sorted(loaded, key=lambda i: abs(i - self.index), reverse=True):
+                if total <= self.memory_budget or i == self.index:
+                    break
+                del self._futures[i]
+                total -= loaded[i]
+
+    def _prefetch_around(self):
+        with self._lock:
+            self._schedule(self.index)
+            for offset in range(1, self.prefetch + 1):
+                self._schedule(self.index + offset)
+            self._schedule(self.index - 1)
+            # Forget pending loads that are now far away
+            for i in list(self._futures):
+                if not (self.index - 1 <= i <= self.index + self.prefetch):
+                    if self._futures[i].cancel() or self._futures[i].done():
+                        del self._futures[i]
+
+    def go_to(self, index):
+        """Make `index` the current case and return it, waiting only if it is not prefetched
+
+        The current index only changes once the case has loaded, so if loading raises,
+        the previous case stays current.
+        """
+        if not 0 <= index < len(self.paths):
+            raise IndexError("No such case in the worklist")
+        with self._lock:
+            self._schedule(index)
+            future = self._futures[index]
+        instrumentation.count('worklist_prefetch.hit' if future.done() else 'worklist_prefetch.miss')
+        try:
+            case = future.result()
+        except Exception:
+            # Try the file again next time instead of keeping the failed load
+            with self._lock:
+                if self._futures.get(index) is future:
+                    del self._futures[index]
+            raise
+        self.index = index
+        self._prefetch_around()
+        return case
+
+    def current(self):
+        return self.go_to(self.index)
+
+    def has_next(self):
+        return self.index + 1 < len(self.paths)
+
+    def has_previous(self):
+        return self.index > 0
+
+    def next(self):
+        return self.go_to(self.index + 1)
+
+    def previous(self):
+        return self.go_to(self.index - 1)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._futures.clear()